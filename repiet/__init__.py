@@ -3,9 +3,14 @@ from . import lexer
 from . import parser
 from . import tracer
 from . import optimizer
+from . import minimizer
+from . import analyzer
+from . import peephole
+from . import ir
+from . import cache
 from . import backends
 __pkgname__ = 'repiet'
-__version__ = "0.2.1"
+__version__ = "0.3.0"
 __authorname__ = "Kelly Boothby"
 __authoremail__ = ""
 __description__ = "A Piet compiler, targeting a variety of languages (including Piet)"
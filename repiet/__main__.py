@@ -1,8 +1,25 @@
 import argparse
+import os
 import sys
 import repiet
 import tempfile
 
+def _sweepable(kw):
+    """Wraps the argparse type of an opinion to accept a comma-separated
+    list of values, which is returned as a tuple"""
+    kind = kw.pop('type', str)
+    choices = kw.pop('choices', None)
+    if choices:
+        kw['metavar'] = '{%s}' % ','.join(map(str, choices))
+    def parse(arg):
+        values = tuple(map(kind, arg.split(',')))
+        for v in values:
+            if choices and v not in choices:
+                raise argparse.ArgumentTypeError("invalid choice: %r (choose from %s)" % (v, ', '.join(map(repr, choices))))
+        return values[0] if len(values) == 1 else values
+    kw['type'] = parse
+    return kw
+
 def main(argv=None):
     #Determine if the user has asked for --help.  If not, we hide certain
     #arguments to keep usage / help simple.  This could probably be done
@@ -13,17 +30,23 @@ def main(argv=None):
 
     parser = argparse.ArgumentParser(prog='repiet', description='Compile or execute a Piet program.',
                                      epilog='' if longhelp else 'Additional arguments available with --help')
-    parser.add_argument('source', type=str, help='source image')
+    parser.add_argument('source', type=str, help='source image, or binary IR file')
     parser.add_argument('-o', '--output', type=str, help='output filename')
+    parser.add_argument('--dump', type=str, help='also write the optimized program to this binary IR file')
     parser.add_argument('-b', '--backend', type=str,
         choices=('c', 'c++', 'piet', 'python', 'repiet'),
         default='python', help='language to compile to')
-    parser.add_argument('-O', '--optimize', default=0, type=int, help='optimization level')
+    parser.add_argument('-O', '--optimize', type=int, help='optimization level (by default, 0 -- or the stage of an IR file)')
     parser.add_argument('-x', '--execute', action='store_true', 
         default=False, help = 'execute the compilation product')
+    parser.add_argument('--cache-dir', type=str, help='directory of a cache of compiled programs, to reuse and fill')
+    parser.add_argument('--cache-size', type=repiet.util._positive, default=256,
+        help='size of the cache, in megabytes -- the least recently used entries are evicted' if longhelp else argparse.SUPPRESS)
 
-    opinionparser = parser.add_argument_group('parsing/lexing arguments')
+    opinionparser = parser.add_argument_group('parsing/lexing arguments',
+        'each accepts a comma-separated list, to compile under every combination of opinions')
     for (op, kw) in repiet.util.opinion_options.items():
+        kw = _sweepable(dict(kw))
         kw['default'] = argparse.SUPPRESS
         if op != 'codel_size' and not longhelp:
             kw['help'] = argparse.SUPPRESS
@@ -32,6 +55,14 @@ def main(argv=None):
     args = parser.parse_args(argv)
     opinions = {k:v for (k,v) in vars(args).items() if k in repiet.util.opinion_options}
 
+    #an IR file starts at the stage it was dumped from, and can't go back
+    ir = repiet.ir.IR(args.source) if repiet.ir.is_ir(args.source) else None
+    stage = 0 if ir is None or ir.stage is None else ir.stage
+    if args.optimize is None:
+        args.optimize = stage
+    elif repiet.compiler._stage_level(args.optimize) < stage:
+        parser.error("{} holds a stage {} graph, which can't be compiled below -O {}".format(args.source, stage, stage))
+
     mode = 'w'
     if args.backend == 'c++':
         from repiet.backends import cppbackend as backend
@@ -59,16 +90,37 @@ def main(argv=None):
 
     backend=backend()
 
-    if args.optimize <= 0:
-        prog = repiet.parser.Parser(args.source, **opinions)
-    elif args.optimize == 1:
-        prog = repiet.tracer.Tracer(args.source, **opinions)
+    if any(isinstance(v, tuple) for v in opinions.values()):
+        #sweep over the opinions, lexing once for each lexing opinion and
+        #writing a file for each combination
+        if ir is not None:
+            parser.error("an IR file has already been parsed, so opinions can't be swept over it")
+        for flag, value in (('--dump', args.dump), ('--cache-dir', args.cache_dir)):
+            if value is not None:
+                parser.error("{} can't be used while sweeping over opinions".format(flag))
+        root, ext = os.path.splitext(output)
+        for combo, code in repiet.compiler.Sweep(args.source, args.backend, args.optimize, **opinions).items():
+            tag = '.'.join('%s-%s' % (k, v) for k, v in combo if isinstance(opinions[k], tuple))
+            with open('%s.%s%s' % (root, tag, ext), mode) as outfile:
+                outfile.write(code)
+            if args.execute:
+                backend.execute('%s.%s%s' % (root, tag, ext))
+        return
+
+    if args.cache_dir is None:
+        source = args.source if ir is None else ir
+        prog = repiet.compiler.Stage(source, args.optimize, **opinions)
+        code = repiet.compiler.compiler(prog, backend, repiet.compiler._registers(args.optimize)).render()
     else:
-        prog = repiet.optimizer.StaticEvaluator(args.source, **opinions)
+        cache = repiet.cache.Cache(args.cache_dir, args.cache_size << 20)
+        code = cache.compile(args.source, args.backend, args.optimize, **opinions)
+        if args.dump is not None:
+            prog = cache.stage(args.source, args.optimize, **opinions)
+    if args.dump is not None:
+        repiet.ir.dump(prog, args.dump)
 
-    compiler = repiet.compiler.compiler(prog, backend)
     with open(output, mode) as outfile:
-        outfile.write(compiler.render())    
+        outfile.write(code)
 
     if args.execute:
         backend.execute(output)
@@ -1,6 +1,20 @@
 from repiet._backends.generic import backend
+from repiet.analyzer import _POPS
+from repiet.util import Folded as _Folded, Unchecked as _Unchecked
 import subprocess
 
+#format strings of each opcode, for writing out expressions (in C and C++)
+#-- the second argument is the top of the stack
+_forms = {
+    "ADD" : "({}+{})",
+    "SBT" : "({}-{})",
+    "MLT" : "({}*{})",
+    "DVD" : "({}/{})",
+    "MOD" : "(({1}+{0}%{1})%{1})",
+    "NOT" : "(!{})",
+    "GRT" : "({}>{})",
+}
+
 class cbackend(backend):
     def define(self, name, ops, dest):
         if dest is None:
@@ -47,6 +61,149 @@ class cbackend(backend):
             "CUT" : "if (pop1(&a)) printf(\"%c\", a);",
          }[i]
 
+    def folded(self, op, fallback):
+        if any(eff == "DIN" for eff, _ in op.effects):
+            #scanf pushes nothing when there's no number to read, and the
+            #fold can't take that back
+            return fallback
+        names = ["s%d"%k for k in range(1, op.depth+1)] + ["i%d"%x for eff, x in op.effects if eff == "CIN"]
+        code = ["int %s;"%", ".join(names)] if names else []
+        code.extend("s%d=d[--p];"%k for k in range(1, op.depth+1))
+        for eff, x in op.effects:
+            if eff == "CIN":
+                code.append("A=getc(stdin); i%d=(A==EOF)?-1:A;"%x)
+            elif eff == "DUT":
+                code.append("printf(\"%%d\", %s);"%self.expression(x, _forms))
+            else:
+                code.append("printf(\"%%c\", %s);"%self.expression(x, _forms))
+        code.extend("psh(%s);"%self.expression(x, _forms) for x in op.stack)
+        if not op.depth or fallback is None:
+            return "{%s}"%"".join(code)
+        return "if (p>=%d) {%s} else {%s}"%(op.depth, "".join(code), fallback)
+
+    def unchecked(self, op, options):
+        if isinstance(op, tuple):
+            return self.folded(op, None)
+        elif op == "PTR":
+            p0, p1, p2, p3 = options
+            return """switch((d[--p]%%4+4)%%4) {case 1: goto %s; case 2: goto %s; case 3: goto %s;}
+goto %s;"""%(p1, p2, p3, p0)
+        elif op == "SWT":
+            p0, p1 = options
+            return "if (d[--p]&1) goto {}; goto {};".format(p1, p0)
+        return {
+            "POP" : "p--;",
+            "ADD" : "p--; d[p-1]+=d[p];",
+            "SBT" : "p--; d[p-1]-=d[p];",
+            "MLT" : "p--; d[p-1]*=d[p];",
+            "DVD" : "a=d[--p]; b=d[--p]; if (a) psh(b/a);",
+            "MOD" : "a=d[--p]; b=d[--p]; if (a) psh((a+b%a)%a);",
+            "NOT" : "d[p-1]=!d[p-1];",
+            "GRT" : "p--; d[p-1]=d[p-1]>d[p];",
+            "DPL" : "d[p]=d[p-1]; p++;",
+            "RLL" : "a=d[--p]; b=d[--p]; rll(a, b);",
+            "DUT" : "printf(\"%d\", d[--p]);",
+            "CUT" : "printf(\"%c\", d[--p]);",
+         }.get(op)
+
+    def lower(self, ops, options, dispatch):
+        #values pushed within the Node are kept in fresh locals (or as
+        #constants) on a compile-time stack, and only spilled to d[] at the
+        #end of the Node, or before an operation we can't follow -- values
+        #from beneath are loaded as they're needed, if the stack is known to
+        #hold them
+        stack = []
+        code = []
+        regs = []
+
+        def value(x):
+            return x if isinstance(x, str) else self.expression(x, _forms)
+
+        def fresh(x):
+            r = "r%d"%len(regs)
+            regs.append(r)
+            code.append("%s=%s;"%(r, x))
+            return r
+
+        def take(n):
+            return [stack.pop() if stack else fresh("d[--p]") for _ in range(n)]
+
+        def spill():
+            code.extend("d[p++]=%s;"%value(x) for x in stack)
+            stack.clear()
+
+        for op in ops:
+            i = op.op if isinstance(op, _Unchecked) else op
+            if isinstance(i, int):
+                stack.append(i)
+            elif isinstance(i, _Folded):
+                spill()
+                code.append(dispatch(op))
+            elif isinstance(i, tuple):
+                stk, out = i
+                stack.extend(stk)
+                code.extend("printf(\"%%c\", %d);"%ord(c) for c in out)
+            elif i == "DIN" or (op is i and len(stack) < _POPS.get(i, 0)):
+                #this may not push, or the stack may not hold enough values
+                spill()
+                code.append(dispatch(op))
+            elif i == "NOP":
+                pass
+            elif i == "POP":
+                if stack:
+                    stack.pop()
+                else:
+                    code.append("p--;")
+            elif i in ("ADD", "SBT", "MLT", "GRT"):
+                a, b = take(2)
+                stack.append(fresh(_forms[i].format(value(b), value(a))))
+            elif i in ("DVD", "MOD"):
+                a, b = take(2)
+                if isinstance(a, int) and a:
+                    stack.append(fresh(_forms[i].format(value(b), value(a))))
+                else:
+                    #a division by zero pushes nothing
+                    spill()
+                    code.append("if (%s) d[p++]=%s;"%(value(a), _forms[i].format(value(b), value(a))))
+            elif i == "NOT":
+                a, = take(1)
+                stack.append(fresh(_forms[i].format(value(a))))
+            elif i == "DPL":
+                a, = take(1)
+                stack.extend((a, a))
+            elif i == "RLL":
+                a, b = take(2)
+                if isinstance(a, int) and isinstance(b, int) and b <= len(stack):
+                    #a roll of known values is just a permutation
+                    x = a%b if b > 0 else 0
+                    if x:
+                        stack[-b:] = stack[-x:] + stack[-b:-x]
+                else:
+                    spill()
+                    code.append("rll(%s, %s);"%(value(a), value(b)))
+            elif i == "CIN":
+                code.append("A=getc(stdin);")
+                stack.append(fresh("(A==EOF)?-1:A"))
+            elif i in ("DUT", "CUT"):
+                a, = take(1)
+                code.append("printf(\"%%%s\", %s);"%("d" if i == "DUT" else "c", value(a)))
+            elif i == "SWT":
+                a, = take(1)
+                spill()
+                p0, p1 = options
+                code.append("if (%s&1) goto %s; goto %s;"%(value(a), p1, p0))
+            elif i == "PTR":
+                a, = take(1)
+                spill()
+                p0, p1, p2, p3 = options
+                code.append("switch((%s%%4+4)%%4) {case 1: goto %s; case 2: goto %s; case 3: goto %s;}\ngoto %s;"%(value(a), p1, p2, p3, p0))
+            else:
+                raise RuntimeError("Unfamiliar operation")
+        spill()
+        if regs:
+            return "{int %s;%s}"%(", ".join(regs), "".join(code))
+        return "".join(code)
+
     def render(self, defs, start):
         if start is None:
             defs = "end:return 0;"
@@ -1,4 +1,5 @@
 from repiet._backends.generic import backend
+from repiet._backends.c import _forms
 import subprocess
 
 class cppbackend(backend):
@@ -47,6 +48,52 @@ class cppbackend(backend):
             "CUT" : "if (pop(A)) cout << A;",
          }[i]
 
+    def folded(self, op, fallback):
+        if any(eff == "DIN" for eff, _ in op.effects):
+            #cin pushes nothing when there's no number to read, and the fold
+            #can't take that back
+            return fallback
+        names = ["s%d"%k for k in range(1, op.depth+1)] + ["i%d"%x for eff, x in op.effects if eff == "CIN"]
+        code = ["int %s;"%", ".join(names)] if names else []
+        code.extend("s%d=d.back();d.pop_back();"%k for k in range(1, op.depth+1))
+        for eff, x in op.effects:
+            if eff == "CIN":
+                code.append("cin.get(A); i%d=cin.eof()?-1:static_cast<int>(A);"%x)
+            elif eff == "DUT":
+                code.append("cout << %s;"%self.expression(x, _forms))
+            else:
+                code.append("cout << static_cast<char>(%s);"%self.expression(x, _forms))
+        code.extend("psh(%s);"%self.expression(x, _forms) for x in op.stack)
+        if not op.depth or fallback is None:
+            return "{%s}"%"".join(code)
+        return "if (d.size()>=%d) {%s} else {%s}"%(op.depth, "".join(code), fallback)
+
+    def unchecked(self, op, options):
+        if isinstance(op, tuple):
+            return self.folded(op, None)
+        elif op == "PTR":
+            p0, p1, p2, p3 = options
+            return """a=d.back(); d.pop_back();
+switch((a%%4+4)%%4) {case 1: goto %s; case 2: goto %s; case 3: goto %s;}
+goto %s;"""%(p1, p2, p3, p0)
+        elif op == "SWT":
+            p0, p1 = options
+            return "a=d.back(); d.pop_back(); if (a&1) goto {}; goto {};".format(p1, p0)
+        return {
+            "POP" : "d.pop_back();",
+            "ADD" : "a=d.back(); d.pop_back(); d.back()+=a;",
+            "SBT" : "a=d.back(); d.pop_back(); d.back()-=a;",
+            "MLT" : "a=d.back(); d.pop_back(); d.back()*=a;",
+            "DVD" : "a=d.back(); d.pop_back(); b=d.back(); d.pop_back(); if (a) psh(b/a);",
+            "MOD" : "a=d.back(); d.pop_back(); b=d.back(); d.pop_back(); if (a) psh((a+b%a)%a);",
+            "NOT" : "d.back()=!d.back();",
+            "GRT" : "a=d.back(); d.pop_back(); d.back()=d.back()>a;",
+            "DPL" : "d.push_back(d.back());",
+            "RLL" : "a=d.back(); d.pop_back(); b=d.back(); d.pop_back(); rll(a, b);",
+            "DUT" : "cout << d.back(); d.pop_back();",
+            "CUT" : "cout << static_cast<char>(d.back()); d.pop_back();",
+         }.get(op)
+
     def render(self, defs, start):
         if start is None:
             defs = "end:return 0;"
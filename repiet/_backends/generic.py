@@ -10,6 +10,28 @@ class backend:
     def push_stack(self, x):
         return self.join_instructions(self.push(c) for c in x)
 
+    def folded(self, op, fallback):
+        return fallback
+
+    def unchecked(self, op, options):
+        #writes out an operation (or a Folded operation) which is known to
+        #find enough values on the stack -- or returns None, to check anyway
+        return None
+
+    def lower(self, ops, options, dispatch):
+        #writes out the operations of a Node as a whole, keeping values in
+        #registers -- or returns None, to write each out with dispatch
+        return None
+
+    def expression(self, x, forms):
+        #writes out a value of a Folded operation (see repiet.util), where
+        #forms maps each opcode to a format string of its arguments
+        if isinstance(x, int):
+            return str(x) if x >= 0 else "(%d)"%x
+        elif x[0] in ('s', 'i'):
+            return "%s%d"%x
+        return forms[x[0]].format(*(self.expression(y, forms) for y in x[1:]))
+
     def join_instructions(self, strux):
         return "".join(strux)
 
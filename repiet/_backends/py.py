@@ -12,7 +12,7 @@ class py3backend(backend):
         return " a = pop()\n return [{}][0 if a is None else (a%4+4)%4]\n".format(', '.join(options))
 
     def switch(self, options):
-        return " a = pop()\n return [{}][1 if a is None else a&1]\n".format(', '.join(options))
+        return " a = pop()\n return [{}][0 if a is None else a&1]\n".format(', '.join(options))
 
     def instruction(self, i):
         return {
@@ -33,6 +33,56 @@ class py3backend(backend):
             "SBT" : " a,b = pop2()\n a is not None and psh(b-a)\n",
          }[i]
     
+    def folded(self, op, fallback):
+        forms = {
+            "ADD" : "({}+{})",
+            "SBT" : "({}-{})",
+            "MLT" : "({}*{})",
+            "DVD" : "({}//{})",
+            "MOD" : "({}%{})",
+            "NOT" : "int(not {})",
+            "GRT" : "int({}>{})",
+        }
+        code = ["s%d = stack.pop()\n"%k for k in range(1, op.depth+1)]
+        for eff, x in op.effects:
+            if eff == "DIN":
+                code.append("i%d = int(input())\n"%x)
+            elif eff == "CIN":
+                code.append("i%d = ord(input())\n"%x)
+            elif eff == "DUT":
+                code.append("print({}, sep='', end='', flush=1)\n".format(self.expression(x, forms)))
+            else:
+                code.append("print(chr({}&255), sep='', end='', flush=1)\n".format(self.expression(x, forms)))
+        if op.stack:
+            code.append("stack.extend(({},))\n".format(", ".join(self.expression(x, forms) for x in op.stack)))
+        if not op.depth or fallback is None:
+            return "".join(" "+c for c in code)
+        #indent everything one more space, into an if/else
+        fallback = "".join(" "+c for c in fallback.splitlines(True)) or "  pass\n"
+        return " if len(stack) >= {}:\n{} else:\n{}".format(op.depth, "".join("  "+c for c in code), fallback)
+
+    def unchecked(self, op, options):
+        if isinstance(op, tuple):
+            return self.folded(op, None)
+        elif op == "PTR":
+            return " return [{}][stack.pop()%4]\n".format(', '.join(options))
+        elif op == "SWT":
+            return " return [{}][stack.pop()&1]\n".format(', '.join(options))
+        return {
+            "POP" : " stack.pop()\n",
+            "DPL" : " stack.append(stack[-1])\n",
+            "NOT" : " stack[-1] = int(not stack[-1])\n",
+            "DUT" : " print(stack.pop(), sep='', end='', flush=1)\n",
+            "CUT" : " print(chr(stack.pop()&255), sep='', end='', flush=1)\n",
+            "DVD" : " a = stack.pop()\n b = stack.pop()\n a!=0 and psh(b//a)\n",
+            "MOD" : " a = stack.pop()\n b = stack.pop()\n a!=0 and psh(b%a)\n",
+            "GRT" : " a = stack.pop()\n stack[-1] = int(stack[-1]>a)\n",
+            "RLL" : " a = stack.pop()\n rll(a, stack.pop())\n",
+            "ADD" : " a = stack.pop()\n stack[-1] += a\n",
+            "MLT" : " a = stack.pop()\n stack[-1] *= a\n",
+            "SBT" : " a = stack.pop()\n stack[-1] -= a\n",
+         }.get(op)
+
     def print_str(self, x):
         return "".join((" print(",repr(x),", sep='', end='', flush=1)\n"))
 
@@ -55,8 +105,9 @@ def psh(*X): stack.extend(X)
 def pop(): return stack.pop() if stack else None
 def pop2(): return (None, None) if len(stack) < 2 else (stack.pop(), stack.pop())
 def rll(x, y):
+ if y <= 0 or y > len(stack): return
  x %= y
- if y <= 0 or x == 0: return
+ if x == 0: return
  z = -abs(x) + y * (x < 0)
  stack[-y:] = stack[z:] + stack[-y:z]
 """, defs, """
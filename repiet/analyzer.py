@@ -0,0 +1,192 @@
+from math import inf as _inf
+from repiet.parser import Parser as _Parser
+from repiet.tracer import Tracer as _Tracer
+from repiet.optimizer import StaticEvaluator as _StaticEvaluator
+from repiet.minimizer import Minimizer as _Minimizer
+from repiet.ir import IR as _IR
+from repiet.util import Node as _Node, Folded as _Folded, Unchecked as _Unchecked
+
+#the number of values popped by each operation -- when the stack holds fewer,
+#the operation is skipped, and the stack is left as it was
+_POPS = dict(POP=1, NOT=1, DPL=1, DUT=1, CUT=1, SWT=1, PTR=1,
+             ADD=2, SBT=2, MLT=2, DVD=2, MOD=2, GRT=2, RLL=2)
+
+#the fewest and the most values pushed by each operation, once it has popped
+#(a division by zero pushes nothing, and a read may come up empty)
+_PUSHES = dict(NOP=(0, 0), POP=(0, 0), NOT=(1, 1), DPL=(2, 2), DUT=(0, 0),
+               CUT=(0, 0), SWT=(0, 0), PTR=(0, 0), ADD=(1, 1), SBT=(1, 1),
+               MLT=(1, 1), DVD=(0, 1), MOD=(0, 1), GRT=(1, 1), RLL=(0, 0),
+               DIN=(0, 1), CIN=(0, 1))
+
+#the number of times the bounds of a Node may change before we give up on
+#them -- loops which push or pop would otherwise move them one at a time
+_WIDEN = 4
+
+class DepthAnalyzer:
+    """
+    A stack-depth analyzer for parse graphs.  We take the Nodes output by any
+    of the other stages, and bound the depth of the stack at each operation:
+    the program starts on an empty stack, and a Node is entered with the
+    bounds of each Node leading to it, which is a dataflow problem solved by
+    iterating to a fixpoint.
+
+    Where the stack is proven to hold enough values for an operation, we
+    wrap it as an Unchecked operation (see repiet.util), which backends may
+    compile without checking the depth of the stack.  Where the stack never
+    holds enough, the operation is skipped at runtime, as the language spec
+    recommends -- so we drop it (and a PTR or SWT which is dropped jumps to
+    its first destination).
+
+    DepthAnalyzers have a similar interface to Parsers -- the name of the
+    root is D.root(), Node objects are fetched with D[name], and D.name(name)
+    makes a human-readable name, that of the Node of the source.  Nodes are
+    named by dense integer ids, in the order they're reached from the root,
+    and Nodes which can't be reached are left out.
+
+    The source is a Parser, Tracer, StaticEvaluator, Minimizer or IR, or
+    anything a Minimizer can be built from -- an image filename or a Lexer.
+    """
+    #the optimization stage of the graph (see repiet.ir)
+    stage = 4
+
+    def __init__(self, source, **opinions):
+        prog = source if isinstance(source, (_Parser, _Tracer, _StaticEvaluator, _Minimizer, _IR)) else _Minimizer(source, **opinions)
+        self._prog = prog
+        self._graph = []
+        self._reps = []
+        if prog.root() is None:
+            self._root = None
+        else:
+            self._root = 0
+            self._analyze(prog)
+
+    def root(self):
+        """
+        Returns the root of the program.  If the program is trivial (that is,
+        returns immediately with no input or output), we return None
+        """
+        return self._root
+
+    def __getitem__(self, name):
+        """
+        Returns the Node associated with the input `name`, which must not be
+        None -- Nodes are of the same form as those of the source, but some
+        operations are wrapped as Unchecked
+        """
+        return self._graph[name]
+
+    def flatten(self):
+        """
+        Returns all Node objects as a list
+        """
+        return list(self._graph)
+
+    def name(self, name):
+        """
+        Returns a human-readable string naming the Node `name`
+        """
+        return self._prog.name(self._reps[name])
+
+    def _analyze(self, prog):
+        """
+        Finds the bounds on the depth of the stack entering each Node of
+        prog with a worklist algorithm, then annotates the Nodes which are
+        reached -- numbering them in the order they're reached.
+        """
+        nodes = prog.flatten()
+        index = {node.name: i for i, node in enumerate(nodes)}
+        root = index[prog.root()]
+        bounds = {root: (0, 0)}
+        changes = {}
+        to_process = [root]
+        while to_process:
+            i = to_process.pop()
+            _, dests, (lo, hi) = _transfer(nodes[i].ops, nodes[i].dests, *bounds[i])
+            for d in dests:
+                d = index[d]
+                old = bounds.get(d)
+                if old is None:
+                    new = lo, hi
+                else:
+                    new = min(old[0], lo), max(old[1], hi)
+                    if new == old:
+                        continue
+                    changes[d] = changes.get(d, 0) + 1
+                    if changes[d] > _WIDEN:
+                        new = 0 if new[0] < old[0] else new[0], _inf if new[1] > old[1] else new[1]
+                bounds[d] = new
+                to_process.append(d)
+
+        graph = self._graph
+        ids = {root: 0}
+        order = [root]
+        graph.append(None)
+        to_process = [root]
+        while to_process:
+            i = to_process.pop()
+            ops, dests, _ = _transfer(nodes[i].ops, nodes[i].dests, *bounds[i])
+            dnames = []
+            for d in dests:
+                d = index[d]
+                if d not in ids:
+                    ids[d] = len(order)
+                    order.append(d)
+                    graph.append(None)
+                    to_process.append(d)
+                dnames.append(ids[d])
+            graph[ids[i]] = _Node(ids[i], tuple(ops), tuple(dnames))
+        self._reps = [nodes[i].name for i in order]
+
+def _transfer(ops, dests, lo, hi):
+    """
+    Runs through the operations ops on a stack holding between lo and hi
+    values, annotating them -- returns the annotated operations, the
+    destinations which may be taken, and the bounds on the stack at the end
+    """
+    out = []
+    todo = list(reversed(ops))
+    while todo:
+        op = todo.pop()
+        if isinstance(op, _Unchecked):
+            op = op.op
+        if isinstance(op, int):
+            out.append(op)
+            lo, hi = lo + 1, hi + 1
+        elif isinstance(op, _Folded):
+            k = len(op.stack)
+            if hi < op.depth:
+                #the guard always fails, so we're left with the original ops
+                todo.extend(reversed(op.ops))
+            elif any(eff == 'DIN' for eff, _ in op.effects):
+                #a read may come up empty, which the fold can't take back --
+                #so the C and C++ backends (and those which can't write out
+                #symbols) perform the original ops instead, and we bound
+                #the stack by those
+                out.append(op)
+                _, _, (lo, hi) = _transfer(op.ops, (), lo, hi)
+            elif lo >= op.depth:
+                out.append(_Unchecked(op))
+                lo, hi = lo - op.depth + k, hi - op.depth + k
+            else:
+                out.append(op)
+                _, _, (l, h) = _transfer(op.ops, (), lo, hi)
+                lo, hi = min(l, k), max(h, hi - op.depth + k)
+        elif isinstance(op, tuple):
+            out.append(op)
+            lo, hi = lo + len(op[0]), hi + len(op[0])
+        else:
+            n = _POPS.get(op, 0)
+            a, b = _PUSHES[op]
+            if hi < n:
+                #this is skipped at runtime... and a branch on an empty stack
+                #goes to the first destination
+                if op in ('PTR', 'SWT'):
+                    dests = dests[:1]
+            elif lo >= n:
+                out.append(_Unchecked(op) if n else op)
+                lo, hi = lo - n + a, hi - n + b
+            else:
+                #the operation is either skipped, or pops n values
+                out.append(op)
+                lo, hi = min(lo, a), max(n - 1, hi - n + b)
+    return out, dests, (lo, hi)
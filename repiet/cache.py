@@ -0,0 +1,139 @@
+import hashlib as _hashlib
+import os as _os
+import tempfile as _tempfile
+import repiet as _repiet
+from repiet.compiler import compiler as _compiler, _stages, _stage_level, _registers, _backend
+from repiet.ir import IR as _IR, dump as _dump, is_ir as _is_ir
+from repiet.util import default_opinions as _default_opinions
+
+__all__ = ["Cache"]
+
+#the lexing engine options only change how the image is lexed, not the result
+_ENGINE = 'lexer', 'strip', 'workers'
+
+class Cache:
+    """
+    A content-addressed cache of compiled Piet programs, kept as files in a
+    directory.  Entries are keyed by a hash of the source file's contents,
+    the opinions and the version of repiet, so an edited image (or a new
+    release) simply misses.
+
+    For each source, the cache holds the graph of each stage which has been
+    built -- parsed, traced and statically evaluated, in the binary format
+    of repiet.ir -- and the rendered output of each backend and optimization
+    level.  A hit on the output skips every stage; a hit on a stage skips
+    the stages before it (including the Lexer, which is only needed to
+    build a Parser).
+
+    The directory is bounded to max_size bytes: when it grows past that, the
+    least recently used entries are evicted.
+    """
+    def __init__(self, directory, max_size=1<<28):
+        self._dir = directory
+        self._max_size = max_size
+        _os.makedirs(directory, exist_ok=True)
+
+    def compile(self, filename, backend, optimization_level = 9012, **opinions):
+        """
+        Compiles the image (or binary IR file) filename to the named backend
+        at the given optimization level, as repiet.compiler.Compile would --
+        reusing and filling the cache.
+        """
+        key = self._key(filename, opinions)
+        for ext in ('txt', 'bin'):
+            path = self._path(key, '{}-O{}.{}'.format(backend, optimization_level, ext))
+            if self._hit(path):
+                #entries are written as bytes -- text is utf-8, whatever the
+                #locale
+                with open(path, 'rb') as f:
+                    data = f.read()
+                return data.decode('utf-8') if ext == 'txt' else data
+        prog = self._stage(key, filename, optimization_level, opinions)
+        code = _compiler(prog, _backend(backend), _registers(optimization_level)).render()
+        text = isinstance(code, str)
+        self._put(key, '{}-O{}.{}'.format(backend, optimization_level, 'txt' if text else 'bin'),
+                  code.encode('utf-8') if text else code)
+        return code
+
+    def stage(self, filename, optimization_level = 9012, **opinions):
+        """
+        Returns the graph compiled at the given optimization level, as
+        repiet.compiler.Stage would -- loaded from the cache as an IR if it's
+        there, and built and stored if not.
+        """
+        return self._stage(self._key(filename, opinions), filename, optimization_level, opinions)
+
+    def _stage(self, key, filename, optimization_level, opinions):
+        """Loads or builds (and stores) the graph for the optimization level"""
+        level = _stage_level(optimization_level)
+        source = _IR(filename) if _is_ir(filename) else filename
+        for k in range(level, -1, -1):
+            path = self._path(key, 'O{}.rpb'.format(k))
+            if self._hit(path):
+                source = _IR(path)
+                break
+        stages = _stages(source, [optimization_level], opinions)
+        for k, prog in stages.items():
+            if not isinstance(prog, _IR):
+                self._put(key, 'O{}.rpb'.format(k), prog)
+        return stages[level]
+
+    def _key(self, filename, opinions):
+        """Hashes the contents of the file, the opinions which affect the
+        compiled program and the version of repiet"""
+        h = _hashlib.sha256()
+        with open(filename, 'rb') as f:
+            for chunk in iter(lambda: f.read(1<<20), b''):
+                h.update(chunk)
+        opinions = _default_opinions(**opinions)
+        h.update(repr(sorted((k, v) for k, v in opinions.items() if k not in _ENGINE)).encode())
+        h.update(_repiet.__version__.encode())
+        return h.hexdigest()
+
+    def _path(self, key, what):
+        return _os.path.join(self._dir, '{}.{}'.format(key, what))
+
+    def _hit(self, path):
+        """Marks the entry at path as recently used, if it exists"""
+        try:
+            _os.utime(path)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def _put(self, key, what, data):
+        """
+        Stores an entry -- bytes, or a graph to be dumped -- then evicts the
+        least recently used entries until the cache fits in max_size bytes.
+        Entries are written to a temporary file and moved into place, so a
+        concurrent reader never sees a partial entry.
+        """
+        fd, tmp = _tempfile.mkstemp(dir=self._dir, suffix='.tmp')
+        try:
+            if isinstance(data, bytes):
+                with _os.fdopen(fd, 'wb') as f:
+                    f.write(data)
+            else:
+                _os.close(fd)
+                _dump(data, tmp)
+            _os.replace(tmp, self._path(key, what))
+        except BaseException:
+            _os.remove(tmp)
+            raise
+        self._evict()
+
+    def _evict(self):
+        entries = []
+        for entry in _os.scandir(self._dir):
+            if entry.is_file() and not entry.name.endswith('.tmp'):
+                st = entry.stat()
+                entries.append((st.st_mtime, st.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self._max_size:
+                break
+            try:
+                _os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
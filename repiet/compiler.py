@@ -1,19 +1,37 @@
+from repiet.lexer import Lexer as _Lexer
 from repiet.parser import Parser as _Parser
 from repiet.tracer import Tracer as _Tracer
 from repiet.optimizer import StaticEvaluator as _StaticEvaluator
+from repiet.minimizer import Minimizer as _Minimizer
+from repiet.analyzer import DepthAnalyzer as _DepthAnalyzer
+from repiet.peephole import Peephole as _Peephole
+from repiet.ir import IR as _IR
+from repiet.util import Folded as _Folded, Unchecked as _Unchecked
 from repiet.backends import py3backend as _py3backend, cppbackend as _cppbackend, pietbackend as _pietbackend
+from repiet.backends import cbackend as _cbackend, irbackend as _irbackend
+from itertools import product as _product
 
 class compiler:
-    def __init__(self, prog, back):
+    def __init__(self, prog, back, registers=False):
         self._back = back
-        self._root = prog.root()
+        #keep the top of the stack in registers within each Node, where the
+        #backend can
+        self._registers = registers
+        #nodes are named by integer ids -- backends get readable labels
+        self._name = name = prog.name
+        root = prog.root()
+        self._root = None if root is None else name(root)
         self._defs = back.join_defs(self._compile_def(x) for x in prog.flatten())
 
     def _compile_def(self, node):
-        dests = node.dests
-        ops = self._back.join_instructions(
-                    self._dispatch(op, dests) for op in node.ops)
-        return self._back.define(node.name, ops, 
+        dests = tuple(map(self._name, node.dests))
+        ops = None
+        if self._registers:
+            ops = self._back.lower(node.ops, dests, lambda op: self._dispatch(op, dests))
+        if ops is None:
+            ops = self._back.join_instructions(
+                        self._dispatch(op, dests) for op in node.ops)
+        return self._back.define(self._name(node.name), ops,
                     dests[0] if len(dests) == 1 else None)
 
     def render(self):
@@ -39,6 +57,15 @@ class compiler:
             return back.push(op)
         elif isinstance(op, str):
             return back.instruction(op)
+        elif isinstance(op, _Unchecked):
+            #the stack is known to hold enough values -- backends without a
+            #faster way to write op out check it anyway
+            code = back.unchecked(op.op, dests)
+            return self._dispatch(op.op, dests) if code is None else code
+        elif isinstance(op, _Folded):
+            #backends which can't write out symbols use the original ops
+            return back.folded(op, back.join_instructions(
+                        self._dispatch(o, dests) for o in op.ops))
         elif isinstance(op, tuple):
             stk, out = op
             if stk and out:
@@ -55,22 +82,128 @@ class compiler:
         else:
             raise RuntimeError("Unfamiliar operation")
 
-def Compile(filename, backend, optimization_level = 9012, **opinions):
-    if optimization_level <= 0:
-        prog = _Parser(filename, **opinions)
-    elif optimization_level == 1:
-        prog = _Tracer(filename, **opinions)
-    elif optimization_level > 1:
-        prog = _StaticEvaluator(filename, **opinions)
+def Compile(source, backend, optimization_level = 9012, **opinions):
+    """
+    Compiles a Piet program to the named backend ('py', 'c', 'cpp', 'piet'
+    or 'repiet') at the given optimization level.  The source is an image
+    filename or an already-built stage -- a Lexer, Parser, Tracer,
+    StaticEvaluator, Minimizer, DepthAnalyzer or Peephole, or an IR read
+    back from a file (an IR without a stage tag is taken to be a parse
+    graph).
 
-    if backend in ('py', 'py3'):
-        back = _py3backend()
+    Either of backend and optimization_level may be a list, in which case
+    the image is lexed and parsed once, each stage is built at most once,
+    and we return a dictionary mapping each pair (backend, level) to the
+    compiled program.
+
+    At optimization level 6 and above, backends which can (so far, only C)
+    keep the top of the stack in local variables within each Node.
+    """
+    backends = [backend] if isinstance(backend, str) else list(backend)
+    levels = [optimization_level] if isinstance(optimization_level, int) else list(optimization_level)
+
+    stages = _stages(source, levels, opinions)
+    out = {(b, l): compiler(stages[_stage_level(l)], _backend(b), _registers(l)).render() for b in backends for l in levels}
+    if isinstance(backend, str) and isinstance(optimization_level, int):
+        return out[backend, optimization_level]
+    return out
+
+def Stage(source, optimization_level = 9012, **opinions):
+    """
+    Builds the graph which is compiled at the given optimization level -- a
+    Parser, Tracer, StaticEvaluator, Minimizer, DepthAnalyzer or Peephole --
+    from any source accepted by Compile.
+    A source which is already at that stage is returned as it is.
+    """
+    return _stages(source, [optimization_level], opinions)[_stage_level(optimization_level)]
+
+def _stages(source, levels, opinions):
+    """Builds each stage needed for the optimization levels from the last,
+    starting from the source -- returns a dictionary keyed by stage"""
+    kinds = _Parser, _Tracer, _StaticEvaluator, _Minimizer, _DepthAnalyzer, _Peephole
+    first = getattr(source, 'stage', -1)
+    if first is None:
+        first = 0
+    if any(_stage_level(l) < first for l in levels):
+        raise ValueError("a {} can't be compiled below optimization level {}".format(type(source).__name__, first))
+    stages = {}
+    prog = source
+    for k in range(max(first, 0), max(map(_stage_level, levels)) + 1):
+        if k != first:
+            prog = kinds[k](prog, **opinions)
+        stages[k] = prog
+    return stages
+
+def Sweep(source, backend, optimization_level = 9012, **opinions):
+    """
+    Compiles a Piet program under every combination of opinions, where each
+    opinion may be a single value or a list of values.  The source is an
+    image filename or a Lexer -- which has already been lexed, so the
+    lexing opinions can't be swept over it.
+
+    Only the lexing opinions (codel_size, noncoding and the engine options)
+    change the Lexer, so the image is lexed once for each combination of
+    those, and a Parser is built from it for each combination of the rest.
+    Combinations which produce identical parse graphs (and agree on the
+    opinions of the later stages) share everything downstream.
+
+    Returns a dictionary mapping each combination, as a tuple of (opinion,
+    value) pairs sorted by opinion, to the result of Compile.
+    """
+    names = sorted(opinions)
+    values = [v if isinstance(v, (list, tuple)) else [v] for v in (opinions[k] for k in names)]
+    if isinstance(source, _Lexer):
+        swept = [k for k, v in zip(names, values) if k in _LEXING and len(v) > 1]
+        if swept:
+            raise ValueError("can't sweep the lexing opinions {} over a Lexer".format(', '.join(swept)))
+    lexers = {}
+    compiled = {}
+    out = {}
+    for combo in _product(*values):
+        combo = tuple(zip(names, combo))
+        ops = dict(combo)
+        lexkey = tuple((k, v) for k, v in combo if k in _LEXING)
+        lexer = lexers.get(lexkey)
+        if lexer is None:
+            lexer = lexers[lexkey] = source if isinstance(source, _Lexer) else _Lexer(source, **ops)
+        parser = _Parser(lexer, **ops)
+        graph = _graph(parser), tuple((k, v) for k, v in combo if k in _EVALUATING)
+        if graph not in compiled:
+            compiled[graph] = Compile(parser, backend, optimization_level, **ops)
+        out[combo] = compiled[graph]
+    return out
+
+#the opinions read by the Lexer
+_LEXING = 'codel_size', 'noncoding', 'lexer', 'strip', 'workers'
+
+#the opinions read by the StaticEvaluator and the Peephole
+_EVALUATING = 'budget', 'evaluation', 'peephole'
+
+def _graph(parser):
+    """A hashable summary of a parse graph -- equal for equal graphs"""
+    nodes = parser.flatten()
+    return parser.root(), tuple(map(parser.name, range(len(nodes)))), tuple((n.ops, n.dests) for n in nodes)
+
+def _stage_level(level):
+    """The stage used at an optimization level -- 0 for the Parser, 1 for the
+    Tracer, 2 for the StaticEvaluator, 3 for the Minimizer and 4 for the
+    DepthAnalyzer and 5 for the Peephole"""
+    return 0 if level <= 0 else min(level, 5)
+
+def _registers(level):
+    """Whether the stack is lowered to registers at an optimization level"""
+    return level >= 6
+
+def _backend(backend):
+    if backend in ('py', 'py3', 'python'):
+        return _py3backend()
     elif backend in ('c++', 'cpp'):
-        back = _cppbackend()
+        return _cppbackend()
+    elif backend in ('c', ):
+        return _cbackend()
     elif backend in ('piet', ):
-        back = _pietbackend()
+        return _pietbackend()
+    elif backend in ('repiet', 'ir'):
+        return _irbackend()
     else:
         raise NotImplementedError("backend is not implemented")
-
-    return compiler(prog, back).render()
-
@@ -0,0 +1,255 @@
+from mmap import mmap as _mmap, ACCESS_READ as _ACCESS_READ
+import struct as _struct
+import numpy as _np
+from repiet.util import Node as _Node, Folded as _Folded, Unchecked as _Unchecked, OP as _OP
+
+__all__ = ["IR", "dump", "is_ir"]
+
+#file layout, all little-endian:
+#   header          magic, version, stage, root, and the lengths of the tables
+#   opstart         uint32[n+1] -- node i's ops are ops[opstart[i]:opstart[i+1]]
+#   deststart       uint32[n+1] -- likewise, for dests
+#   namestart       uint32[n+1] -- likewise, for names
+#   dests           uint32[m]   -- destination ids
+#   ops             bytes       -- the opcode byte stream
+#   names           bytes       -- utf-8 human-readable names
+_HEADER = _struct.Struct('<4sBBxxiIIII')
+_MAGIC = b'RPIR'
+_VERSION = 1
+_NOSTAGE = 255
+
+#an opcode byte is the index of a 3-character opcode in _OPCODES, or one of
+#these markers followed by zigzag varints (and for _EVAL, a utf-8 string)
+#
+#a _FOLD is followed by the depth, the count and the effects (an opcode
+#and a read index or value), the count and the values of the stack, and the
+#count and the bytes of the original ops.  A value is an _INT, a _SYMBOL or
+#_INPUT and its index, or an opcode followed by its arguments.  An _UNCHECKED
+#is followed by the operation it wraps
+_OPCODES = [op for row in _OP for op in row]
+_CODES = {op: i for i, op in enumerate(_OPCODES)}
+_UNCHECKED = 0xfa
+_INPUT = 0xfb
+_SYMBOL = 0xfc
+_FOLD = 0xfd
+_INT = 0xfe
+_EVAL = 0xff
+_MARKS = {'i': _INPUT, 's': _SYMBOL}
+
+class IR:
+    """
+    A parse graph read back from a binary IR file, as written by dump.  The
+    file is memory-mapped, and Nodes are decoded as they're requested, so
+    a large program can be loaded without lexing or parsing its image.
+
+    IRs have the same interface as Parsers, Tracers and StaticEvaluators --
+    the name of the root is I.root(), Node objects are fetched with I[name]
+    and I.name(name) makes a human-readable name (that of the Node in the
+    graph which was dumped).  Nodes are named by dense integer ids.
+
+    I.stage is the optimization stage of the dumped graph -- 0 through 5 for
+    a Parser, Tracer, StaticEvaluator, Minimizer, DepthAnalyzer or Peephole,
+    or None if it wasn't tagged.  The next stage can be built from an IR, just
+    as it could be built from the dumped graph itself.
+    """
+    def __init__(self, filename):
+        with open(filename, 'rb') as f:
+            self._buf = buf = _mmap(f.fileno(), 0, access=_ACCESS_READ)
+        magic, version, stage, root, n, m, nops, nnames = _HEADER.unpack_from(buf)
+        if magic != _MAGIC or version != _VERSION:
+            raise ValueError("{} is not a repiet IR file (version {})".format(filename, _VERSION))
+        self.stage = None if stage == _NOSTAGE else stage
+        self._root = None if root < 0 else root
+        self._size = n
+        offset = _HEADER.size
+        tables = []
+        for count in (n+1, n+1, n+1, m):
+            tables.append(_np.frombuffer(buf, dtype='<u4', count=count, offset=offset))
+            offset += 4*count
+        self._opstart, self._deststart, self._namestart, self._dests = tables
+        self._ops = memoryview(buf)[offset:offset+nops]
+        self._names = memoryview(buf)[offset+nops:offset+nops+nnames]
+
+    def root(self):
+        """
+        Returns the root of the program, or None if the program is trivial
+        """
+        return self._root
+
+    def __getitem__(self, name):
+        """
+        Returns the Node associated with the input `name`, which must not be
+        None -- see Parser, Tracer and StaticEvaluator for the form of Nodes
+        """
+        if not 0 <= name < self._size:
+            raise IndexError(name)
+        a, b = self._opstart[name:name+2]
+        c, d = self._deststart[name:name+2]
+        return _Node(name, _decode(self._ops[a:b]), tuple(map(int, self._dests[c:d])))
+
+    def flatten(self):
+        """
+        Returns all Node objects as a list
+        """
+        return [self[name] for name in range(self._size)]
+
+    def name(self, name):
+        """
+        Returns a human-readable string naming the Node `name`
+        """
+        a, b = self._namestart[name:name+2]
+        return str(self._names[a:b], 'utf-8')
+
+def dump(prog, filename, stage=None):
+    """
+    Writes the graph of prog -- a Parser, Tracer, StaticEvaluator, Minimizer,
+    DepthAnalyzer, Peephole or IR -- to a binary IR file, to be read back by
+    IR(filename).  Nodes are renumbered by their position in prog.flatten(),
+    and their human-readable names are kept.  The stage tag (see IR)
+    defaults to prog.stage.
+    """
+    if stage is None:
+        stage = getattr(prog, 'stage', None)
+    nodes = prog.flatten()
+    ids = {node.name: i for i, node in enumerate(nodes)}
+    root = prog.root()
+
+    opstart, deststart, namestart = [0], [0], [0]
+    dests, ops, names = [], bytearray(), bytearray()
+    for node in nodes:
+        _encode(node.ops, ops)
+        dests.extend(ids[dest] for dest in node.dests)
+        names += prog.name(node.name).encode('utf-8')
+        opstart.append(len(ops))
+        deststart.append(len(dests))
+        namestart.append(len(names))
+
+    with open(filename, 'wb') as f:
+        f.write(_HEADER.pack(_MAGIC, _VERSION, _NOSTAGE if stage is None else stage,
+                             -1 if root is None else ids[root],
+                             len(nodes), len(dests), len(ops), len(names)))
+        for table in (opstart, deststart, namestart, dests):
+            f.write(_np.array(table, dtype='<u4').tobytes())
+        f.write(ops)
+        f.write(names)
+
+def is_ir(filename):
+    """Determines whether the file is a binary IR file"""
+    with open(filename, 'rb') as f:
+        return f.read(len(_MAGIC)) == _MAGIC
+
+def _encode(ops, out):
+    """Appends the opcode bytes of a tuple of operations to out"""
+    for op in ops:
+        if isinstance(op, str):
+            code = _CODES.get(op)
+            if code is None:
+                raise ValueError("Unfamiliar operation {!r}".format(op))
+            out.append(code)
+        elif isinstance(op, int):
+            out.append(_INT)
+            _varint(op, out)
+        elif isinstance(op, _Unchecked):
+            out.append(_UNCHECKED)
+            _encode((op.op,), out)
+        elif isinstance(op, _Folded):
+            out.append(_FOLD)
+            _varint(op.depth, out)
+            _varint(len(op.effects), out)
+            for eff, x in op.effects:
+                out.append(_CODES[eff])
+                if eff in ('DIN', 'CIN'):
+                    _varint(x, out)
+                else:
+                    _value(x, out)
+            _varint(len(op.stack), out)
+            for x in op.stack:
+                _value(x, out)
+            _varint(len(op.ops), out)
+            _encode(op.ops, out)
+        elif isinstance(op, tuple):
+            stk, s = op
+            s = s.encode('utf-8')
+            out.append(_EVAL)
+            _varint(len(stk), out)
+            for x in stk:
+                _varint(x, out)
+            _varint(len(s), out)
+            out += s
+        else:
+            raise ValueError("Unfamiliar operation {!r}".format(op))
+
+def _value(x, out):
+    """Appends the bytes of a value of a Folded operation to out"""
+    if isinstance(x, int):
+        out.append(_INT)
+        _varint(x, out)
+    elif x[0] in _MARKS:
+        out.append(_MARKS[x[0]])
+        _varint(x[1], out)
+    else:
+        out.append(_CODES[x[0]])
+        for y in x[1:]:
+            _value(y, out)
+
+def _varint(x, out):
+    """Appends the zigzag LEB128 encoding of the int x -- of any size -- to out"""
+    x = 2*x if x >= 0 else -2*x - 1
+    while x > 127:
+        out.append(x & 127 | 128)
+        x >>= 7
+    out.append(x)
+
+def _decode(buf):
+    """Decodes a tuple of operations from its opcode bytes"""
+    ops = []
+    i = 0
+    def varint():
+        nonlocal i
+        x = shift = 0
+        while 1:
+            b = buf[i]
+            i += 1
+            x |= (b & 127) << shift
+            shift += 7
+            if b < 128:
+                return x >> 1 if x & 1 == 0 else -(x >> 1) - 1
+    def value():
+        nonlocal i
+        code = buf[i]
+        i += 1
+        if code == _INT:
+            return varint()
+        elif code == _SYMBOL:
+            return 's', varint()
+        elif code == _INPUT:
+            return 'i', varint()
+        op = _OPCODES[code]
+        return (op,) + tuple(value() for _ in range(1 if op == 'NOT' else 2))
+    def operation():
+        nonlocal i
+        code = buf[i]
+        i += 1
+        if code == _INT:
+            return varint()
+        elif code == _EVAL:
+            stk = tuple(varint() for _ in range(varint()))
+            k = varint()
+            i += k
+            return stk, str(buf[i-k:i], 'utf-8')
+        elif code == _UNCHECKED:
+            return _Unchecked(operation())
+        elif code == _FOLD:
+            depth = varint()
+            effects = []
+            for _ in range(varint()):
+                eff = _OPCODES[buf[i]]
+                i += 1
+                effects.append((eff, varint() if eff in ('DIN', 'CIN') else value()))
+            stack = tuple(value() for _ in range(varint()))
+            return _Folded(depth, tuple(effects), stack, tuple(operation() for _ in range(varint())))
+        else:
+            return _OPCODES[code]
+    while i < len(buf):
+        ops.append(operation())
+    return tuple(ops)
@@ -1,5 +1,10 @@
 from PIL import Image as _Image
 from itertools import product as _product
+from array import array as _array
+import numpy as _np
+import os as _os
+from tempfile import TemporaryDirectory as _TemporaryDirectory
+from concurrent.futures import ProcessPoolExecutor as _ProcessPoolExecutor
 from repiet.util import Lexeme as _Lexeme, SLIDE as _SLIDE, BLOCK as _BLOCK, HL as _HL, default_opinions as _default_opinions
 
 __all__ = ["Lexer"]
@@ -20,20 +25,21 @@ class Lexer:
     the actual image fall out of scope.
 
     Under both of these considerations, we describe the public interface of
-    a Lexer instance L, in two functions.
+    a Lexer instance L, in two functions.  L.codel_size is the codel size
+    used, which is inferred from the image for the opinion codel_size='auto'.
 
     The first function, L.at, is used to interrogate the lexed program at
     a pixel address.  The second function, L.slide, is used to quickly slide
     through whitespace.
 
-    Given a point p = (x, y) or None; L.at(p) is 
+    Given a point p = (x, y) or None; L.at(p) is
         * the constant SLIDE if (x, y) is white,
         * None if p is None, if (x, y) is out of bounds, or a blocking pixel
         * the block containing (x, y)
 
     A block is a namedtuple with the following fields:
-        name: a unique identifier for the block (which happens to be a
-                point (x,y) in the block)
+        name: a unique identifier for the block (which happens to be the
+                first point (x,y) of the block in lexicographic order)
         corners: a dictionary from each (direction pointer, codel chooser)
                 to the pixel in the block furthest in that direction
         size: the number of pixels in the block
@@ -41,153 +47,648 @@ class Lexer:
 
     If a point p = (x, y) is in a sliding region and d is a direction,
         then L.slide(p, d) is the furthest point reachable by sliding
-        d-ward from p.
+        d-ward from p.  This is read straight out of a table of the white
+        runs of each row and column.
 
     Thus, the role of the Lexer is to pre-compute all pixel computation.
 
     Runs in nearly-linear in the number of pixels in the image, and discards
     the Image object after initialization is complete to minimize memory use
+
+    Two lexing engines are available through the 'lexer' opinion.  The
+    'python' engine walks the codels one at a time; the 'numpy' engine loads
+    the image into an array, classifies colors in bulk and labels the blocks
+    with array operations, optionally split over several processes (see the
+    'workers' opinion).  Both produce identical results, stored compactly:
+        * a label grid, holding the index of the block at each codel (or one
+            of the negative constants _BLOCKED and _SLIDING)
+        * a table of blocks, holding their 8 corners, sizes and color codes
+        * four grids of sliding extents, one per direction, holding the
+            codel index of the far end of each white run along its axis
+    The 'stream' engine reads the image in strips of codel rows (see the
+    'strip' opinion) and never holds the whole image in memory; rather than
+    grids, it keeps the runs of each row and the white runs of each column,
+    which are binary searched by L.at and L.slide.  The 'lazy' engine does
+    no work up front, and only lexes the blocks and runs that L.at and
+    L.slide are asked about.
+    Block namedtuples are only built when L.at first encounters the block.
     """
     def __init__(self, filename, **opinions):
-        self._parent = {}
-        self._rank = {}
-        self._slide = {}
-        self._lexeme = {}
         self._opinions = _default_opinions(**opinions)
+        if self._opinions['codel_size'] == 'auto':
+            self._opinions['codel_size'] = _detect_codel_size(filename)
+        self.codel_size = self._opinions['codel_size']
         self._process_opinions()
 
-        image = _Image.open(filename).convert("RGB")
-        self.X, self.Y = image.size
-        self._lex(image)
+        self._lex(filename)
+        self._lexeme = [None] * len(self._size)
+        #the number of rows of the tables orphaned by updates
+        self._orphaned = 0
 
     def at(self, p):
         """Returns SLIDE if p is in a sliding region, the block containing
         p if there is one, and None otherwise -- p can be None or (x,y)"""
-        if (p, 2) in self._slide:
-            return _SLIDE
-        elif p in self._parent:
-            return self._lexeme[self._find(p)]
-        else:
+        if p is None:
+            return None
+        cs = self._opinions['codel_size']
+        x, y = p
+        if x < 0 or y < 0:
+            return None
+        try:
+            label = self._label[x//cs, y//cs]
+        except IndexError:
             return None
+        if label >= 0:
+            lexeme = self._lexeme[label]
+            if lexeme is None:
+                lexeme = self._lexeme[label] = self._tabulated(label)
+            return lexeme
+        return _SLIDE if label == _SLIDING else None
 
     def slide(self, p, d):
         """Returns the address maximum (x, y) reached by sliding d-ward
         p must be in a sliding region"""
-        return self._slide[p, d] if d in (3, 2) else (
-                 self._slide[self._slide[p, d^2], d]
-               )
+        cs = self._opinions['codel_size']
+        x, y = p
+        i, j = x//cs, y//cs
+        return (int(self._run[d][i, j])*cs, y) if d&1 == 0 else (
+               (x, int(self._run[d][i, j])*cs))
+
+    def update(self, filename, box=None):
+        """Re-lexes the image after an edit, which must not change its size.
+        If given, box = (x0, y0, x1, y1) bounds the edited pixels, with
+        x0 <= x < x1 and y0 <= y < y1; otherwise the whole image is compared
+        against the lexed program.  Only the blocks touching the edit and the
+        white runs crossing it are lexed again.
+
+        Returns a pixel box (x0, y0, x1, y1) in the same form, covering every
+        block which has changed and every codel which has changed color -- or
+        None, if nothing changed.
+
+        The blocks lexed again are appended to the tables, and once the rows
+        of the blocks they replace outnumber the rest, the tables are
+        compacted (see _compact).
+
+        Only the 'python' and 'numpy' engines keep the label grid that an
+        update edits -- with the 'stream' or 'lazy' engines, we raise a
+        ValueError."""
+        if self._opinions['lexer'] not in ('python', 'numpy'):
+            raise ValueError("the {!r} lexer can't be updated -- only the 'python' and 'numpy' lexers can".format(self._opinions['lexer']))
+        cs = self._opinions['codel_size']
+        X, Y = self.X, self.Y
+        label = self._label
+        if not label.flags.writeable:
+            label = self._label = label.copy()
+        w, h = label.shape
+        i0, j0, i1, j1 = (0, 0, w, h) if box is None else (
+            max(0, box[0]//cs), max(0, box[1]//cs), min(w, -(-box[2]//cs)), min(h, -(-box[3]//cs)))
+        if i0 >= i1 or j0 >= j1:
+            return None
+        code = self._load(filename, (i0, j0, i1, j1))
+        if (self.X, self.Y) != (X, Y):
+            self.X, self.Y = X, Y
+            raise ValueError("the edited image must have the same size as the original")
+
+        #shrink the box to the codels which actually changed
+        changed = code != self._codes(label[i0:i1, j0:j1])
+        if not changed.any():
+            return None
+        xs, ys = _np.nonzero(changed)
+        code = code[xs.min():xs.max()+1, ys.min():ys.max()+1]
+        i0, j0, i1, j1 = i0 + xs.min(), j0 + ys.min(), i0 + xs.max() + 1, j0 + ys.max() + 1
+
+        #blocks touching the changed codels (or neighboring them, as they
+        #may merge with new codels) are lexed again, in full
+        near = label[max(0, i0-1):i1+1, max(0, j0-1):j1+1]
+        touched = _np.unique(near[near >= 0])
+        corners = self._corners[touched] // cs
+        r0, s0 = corners.min(axis=(0, 1)) if len(touched) else (i0, j0)
+        r1, s1 = corners.max(axis=(0, 1)) + 1 if len(touched) else (i1, j1)
+        r0, s0, r1, s1 = min(r0, i0), min(s0, j0), max(r1, i1), max(s1, j1)
+
+        region = label[r0:r1, s0:s1]
+        mask = _np.isin(region, touched)
+        mask[i0-r0:i1-r0, j0-s0:j1-s0] = True
+        codes = self._codes(region)
+        codes[i0-r0:i1-r0, j0-s0:j1-s0] = code
+        codes[~mask] = _BLACK
+        rw, rh = codes.shape
+
+        #label the new blocks with the vectorized union-find, and append
+        #them to the tables -- the rows of the replaced blocks are orphaned
+        self._orphaned += len(touched)
+        parent = _components(codes)
+        iscode = codes.ravel() < _WHITE
+        cells = _np.flatnonzero(iscode)
+        roots = _np.flatnonzero(iscode & (parent == _np.arange(rw*rh)))
+        n0, n = len(self._size), len(roots)
+        local = _np.searchsorted(roots, parent[cells])
+        order = _np.argsort(local, kind='stable')
+        starts = _np.searchsorted(local[order], _np.arange(n))
+        order = cells[order]
+        m = max(w, h) + 1
+        keys = _corner_keys(order // rh + r0, order % rh + s0, m)
+        if n:
+            keys = _np.maximum.reduceat(keys, starts)
+        self._corners = _np.concatenate((self._corners, _keyed_corners(keys, m, cs)))
+        self._size = _np.concatenate((self._size, _np.diff(_np.append(starts, len(order))).astype(self._size.dtype)))
+        self._color = _np.concatenate((self._color, codes.ravel()[roots].astype(self._color.dtype)))
+        self._lexeme.extend([None] * n)
+
+        relabeled = _np.where(codes.ravel() == _WHITE, _SLIDING, _BLOCKED).astype(label.dtype)
+        relabeled[cells] = local + n0
+        region[mask] = relabeled.reshape(rw, rh)[mask]
 
-    def _lex(self, image):
+        #white runs along the changed rows and columns
+        rows = _slide_runs(label[:, j0:j1] == _SLIDING)
+        cols = _slide_runs(label[i0:i1, :] == _SLIDING)
+        for d in (0, 2):
+            self._run[d][:, j0:j1] = rows[d]
+        for d in (1, 3):
+            self._run[d][i0:i1, :] = cols[d]
+
+        if 2*self._orphaned > len(self._size):
+            self._compact()
+        return r0*cs, s0*cs, r1*cs, s1*cs
+
+    def _compact(self):
+        """Drops the orphaned rows of the tables, and relabels the grid to
+        match -- which takes a pass over the grid, so it's only done once
+        the orphaned rows are the majority"""
+        label = self._label
+        blocks = label >= 0
+        live = _np.zeros(len(self._size), bool)
+        live[label[blocks]] = True
+        label[blocks] = (_np.cumsum(live) - 1)[label[blocks]]
+        self._corners, self._size, self._color = self._corners[live], self._size[live], self._color[live]
+        self._lexeme = [lexeme for lexeme, keep in zip(self._lexeme, live) if keep]
+        self._orphaned = 0
+
+    def _codes(self, label):
+        """Recovers the codes of a grid of labels"""
+        codes = _np.where(label == _SLIDING, _WHITE, _BLACK).astype(_np.uint8)
+        blocks = label >= 0
+        codes[blocks] = self._color[label[blocks]]
+        return codes
+
+    def _tabulated(self, label):
+        """Constructs the Lexeme namedtuple of a block from its row of the
+        tables"""
+        corners = dict(zip(_CORNERS, map(tuple, self._corners[label].tolist())))
+        return _Lexeme(corners[2, 1], corners, int(self._size[label]), _COLORS[self._color[label]])
+
+    def _at_runs(self, p):
+        """at, for the stream engine"""
+        if p is None:
+            return None
+        cs = self._opinions['codel_size']
+        x, y = p
+        i, j = x//cs, y//cs
+        if x < 0 or y < 0 or i >= self._w or j*cs >= self.Y:
+            return None
+        label = self._runlab[self._runkey.searchsorted(j*self._w + i, 'right') - 1]
+        if label >= 0:
+            lexeme = self._lexeme[label]
+            if lexeme is None:
+                lexeme = self._lexeme[label] = self._tabulated(label)
+            return lexeme
+        return _SLIDE if label == _SLIDING else None
+
+    def _slide_runs_at(self, p, d):
+        """slide, for the stream engine"""
+        cs = self._opinions['codel_size']
+        x, y = p
+        i, j = x//cs, y//cs
+        if d&1 == 0:
+            w = self._w
+            keys = self._runkey
+            k = keys.searchsorted(j*w + i, 'right')
+            return (int(keys[k-1]) - j*w)*cs if d == 2 else (
+                   (int(keys[k]) if k < len(keys) else (j+1)*w) - 1 - j*w)*cs, y
+        else:
+            h = self._h
+            k = self._vstart.searchsorted(i*h + j, 'right') - 1
+            return x, (int((self._vstart if d == 3 else self._vend)[k]) - i*h)*cs
+
+    def _at_lazy(self, p):
+        """at, for the lazy engine"""
+        if p is None:
+            return None
+        cs = self._opinions['codel_size']
+        x, y = p
+        i, j = x//cs, y//cs
+        w, h = self._w, self._h
+        if x < 0 or y < 0 or i >= w or j >= h:
+            return None
+        label = self._label[i*h + j]
+        if label == _UNLEXED:
+            label = self._flood(i, j)
+        if label >= 0:
+            return self._lexeme[label]
+        return _SLIDE if label == _SLIDING else None
+
+    def _slide_lazy(self, p, d):
+        """slide, for the lazy engine"""
+        cs = self._opinions['codel_size']
+        x, y = p
+        h = self._h
+        i, j = x//cs, y//cs
+        ends = self._ends[d]
+        end = ends.get(i*h + j)
+        if end is None:
+            #scan the run to its end, which is shared by every codel passed
+            di, dj = _STEPS[d]
+            codel = self._codel
+            passed = [i*h + j]
+            while codel(i+di, j+dj) == _WHITE:
+                i, j = i+di, j+dj
+                passed.append(i*h + j)
+            end = i if d&1 == 0 else j
+            for k in passed:
+                ends[k] = end
+        return (end*cs, y) if d&1 == 0 else (x, end*cs)
+
+    def _codel(self, i, j):
+        """Returns the code of the codel (i, j), classifying it on first use,
+        or None if it is off the image"""
+        w, h = self._w, self._h
+        if not (0 <= i < w and 0 <= j < h):
+            return None
+        c = self._code[i*h + j]
+        if c < 0:
+            cs = self._opinions['codel_size']
+            r, g, b = self._getcolor((i*cs, j*cs))
+            color = (r << 16) | (g << 8) | b
+            c = self._palette.get(color)
+            if c is None:
+                c = self._palette[color] = int(_palette(_np.array([color]), self._opinions['noncoding'])[0])
+            self._code[i*h + j] = c
+        return c
+
+    def _flood(self, i, j):
+        """Lexes the block containing the codel (i, j) by flood-filling it,
+        and returns its label (or _SLIDING or _BLOCKED)"""
+        h = self._h
+        cs = self._opinions['codel_size']
+        codel = self._codel
+        c = codel(i, j)
+        if c >= _WHITE:
+            self._label[i*h + j] = label = _SLIDING if c == _WHITE else _BLOCKED
+            return label
+        label = len(self._lexeme)
+        self._label[i*h + j] = label
+        p = i*cs, j*cs
+        corners = {k: p for k in _CORNERS}
+        size = 0
+        stack = [(i, j)]
+        while stack:
+            i, j = stack.pop()
+            size += 1
+            q = i*cs, j*cs
+            for d, k in corners.items():
+                corners[d] = _select_corner(d[0], d[1], k, q)
+            for di, dj in _STEPS:
+                if codel(i+di, j+dj) == c and self._label[(i+di)*h + j+dj] == _UNLEXED:
+                    self._label[(i+di)*h + j+dj] = label
+                    stack.append((i+di, j+dj))
+        self._size.append(size)
+        self._lexeme.append(_Lexeme(corners[2, 1], corners, size, _COLORS[c]))
+        return label
+
+    def _lex_lazy(self, filename):
+        """
+        Prepares to lex on demand: blocks are flood-filled when L.at first
+        encounters them and runs are scanned when L.slide first crosses them,
+        so the work done scales with the part of the image reached by the
+        parser rather than its area.  The image is kept open for the life of
+        the Lexer.
+        """
+        cs = self._opinions['codel_size']
+        pixels = _mapped(filename)
+        if pixels is not None:
+            self.X, self.Y = X, Y = pixels.shape[1::-1]
+            self._getcolor = lambda p: tuple(pixels[p[1], p[0]].tolist())
+        else:
+            image = _Image.open(filename)
+            self.X, self.Y = X, Y = image.size
+            if image.mode == 'P':
+                palette = list(map(tuple, _palette_rgb(image).tolist()))
+                index = image.load()
+                self._getcolor = lambda p: palette[index[p]]
+            else:
+                self._getcolor = image.convert("RGB").load().__getitem__
+        self._w = w = -(-X//cs)
+        self._h = h = -(-Y//cs)
+        self._code = _array('b', [-1]) * (w*h)
+        self._palette = {}
+        self._label = _array('i', [_UNLEXED]) * (w*h)
+        self._ends = [{} for d in range(4)]
+        self._size = []
+
+    def _lex_python(self, filename):
         """
-        Runs the actual lexing algorithm.
+        Runs the actual lexing algorithm, one codel at a time.
         """
-        parent = self._parent
         union = self._union
-        slide = self._slide
-        _kind = self._kind
-        X, Y = image.size
+        grid = self._load(filename)
+        X, Y = self.X, self.Y
         cs = self._opinions['codel_size']
-        getcolor = image.getpixel
+        w, h = grid.shape
+        n = w*h
+        #codels are stored in flat arrays, in lexicographic order -- the codel
+        #(x, y) lives at index (x//cs)*h + y//cs.
+        code = _array('B', grid.tobytes())
+        del grid
+        parent = _array('i', range(n))
+        size = {}
         corners = {}
-        rank = {}
-        # first we walk over the pixels -- when we encounter whitespace, we
-        # compute the sliding extents of the whitespace.  processing pixels
-        # via product(range(X), range(Y)), the pixel addresses are explored
-        # in lexicographic order -- making iterative constructions downward
-        # and rightward simple, and upward or leftward more challenging --
-        # see the production rules to the right, and self.slide for details
-
-        # also we merge programming-colored pixels into their blocks using
-        # a more-or-less standard DisjointSets datastructure. it's fairly
+        # we merge programming-colored pixels into their blocks using a
+        # more-or-less standard DisjointSets datastructure. it's fairly
         # well-known that rank can be used to compute set sizes (valid only
-        # at roots) -- we use the same trick to compute the "corners"
-        for p in _product(range(0, X, cs), range(0, Y, cs)):
-            x, y = p
-            kind, color = _kind(getcolor(p))
-            for q, z, Z, d0, d1 in [((x+cs, y), x, X-cs, 2, 0),  #peek at pixel to right
-                                    ((x, y+cs), y, Y-cs, 3, 1)]: #peek at pixel below (left,right -> up,down)
-                if z >= Z:                               #rules: W=white, X=nonwhite, C=specific color
-                    if kind == 'slide':                  #------------------------------------------------------
-                        slide[slide[p, d0], d1] = p      #W|: right(left(x, y)) := (x, y)
-                    continue
-                elif z == 0 and kind == 'slide':
-                    slide[(p, d0)] = p                   #|W: left(x, y) := (x, y)
-                kind1, color1 = _kind(getcolor(q))
-                if kind == 'slide':
-                    if kind1 == 'slide':
-                        slide[q, d0] = slide[(p, d0)]    #WW: left(x+1, y) := left(x, y) 
-                    else:
-                        slide[slide[(p, d0)], d1] = p    #WX: right(left(x, y)) := (x, y)
-                elif kind1 == 'slide':
-                    slide[q, d0] = q                     #XW: left(x, y) := (x, y) 
-                elif kind == 'code' and color1 == color:
-                    union(p, q, rank, corners)           #CC: merge programming pixels of blocks
-            if kind == 'code' and p not in parent:
-                parent[p] = p
-                rank[p] = 1
-                corners[p] = {(d, c): p for d in (0, 1, 2, 3) for c in (0, 1)}
-
-        lexemes = self._lexeme
-        for p in _product(range(0, X, cs), range(0, Y, cs)):
-            if p == parent.get(p):
-                lexemes[p] = _Lexeme(p, corners[p], rank[p], getcolor(p))
+        # at roots) -- we use the same trick to compute the "corners", which
+        # we only record for roots of nontrivial sets.  processing codels by
+        # flat index, we only need to peek rightward and downward.
+        for i in range(n):
+            c = code[i]
+            if c < _WHITE:
+                if i < n-h and code[i+h] == c:
+                    union(parent, i, i+h, size, corners, h, cs)
+                if (i+1) % h and code[i+1] == c:
+                    union(parent, i, i+1, size, corners, h, cs)
+
+        #blocks are labeled in order of their first codel, and roots are
+        #forgotten in favor of labels
+        find = self._find
+        label = _array('i', bytes(4*n))
+        roots = {}
+        for i in range(n):
+            c = code[i]
+            if c < _WHITE:
+                r = find(parent, i)
+                label[i] = roots.setdefault(r, len(roots))
+            else:
+                label[i] = _SLIDING if c == _WHITE else _BLOCKED
+        del parent
+
+        self._label = _np.frombuffer(label, _np.int32).reshape(w, h)
+        self._run = _slide_runs(_np.frombuffer(code, _np.uint8).reshape(w, h) == _WHITE)
+        points = [((r//h)*cs, (r%h)*cs) for r in roots]
+        self._corners = _np.array([[corners.get(p, {}).get(k, p) for k in _CORNERS] for p in points],
+                                  _np.int32).reshape(-1, 8, 2)
+        self._size = _np.array([size.get(r, 1) for r in roots], _np.int32)
+        self._color = _np.array([code[r] for r in roots], _np.uint8)
+
+    def _lex_numpy(self, filename):
+        """
+        Runs the lexing algorithm with array operations.  We sample one pixel
+        per codel into a grid of codes with _load, and label the blocks with
+        a vectorized union-find (see _components).  Since the flat index of
+        a codel is x*h + y, flat indices follow the lexicographic order of
+        codels, and the surviving roots are exactly the names of the blocks.
+
+        With several workers, the grid is cut into bands of columns which are
+        lexed in separate processes by _lex_bands -- each band is a
+        contiguous range of flat indices, so the band parents only need to be
+        hooked together across the seams.
+        """
+        cs = self._opinions['codel_size']
+        code = self._load(filename)
+        w, h = code.shape
+        m = max(w, h) + 1
+
+        bounds = sorted(set(_np.linspace(0, w, self._opinions['workers'] + 1).astype(int).tolist()))
+        if len(bounds) > 2:
+            parent, bands, self._run = _lex_bands(code, bounds, m)
+        else:
+            parent, bands = _components(code), None
+        iscode = code.ravel() < _WHITE
+        cells = _np.flatnonzero(iscode)
+        roots = _np.flatnonzero(iscode & (parent == _np.arange(w*h)))
+        labels = _np.full(w*h, _BLOCKED, _np.int32)
+        labels[code.ravel() == _WHITE] = _SLIDING
+        labels[cells] = _np.searchsorted(roots, parent[cells])
+        self._label = labels.reshape(w, h)
+        self._color = code.ravel()[roots]
+
+        if bands is None:
+            #sort the codels by block, and reduce the corner keys of each
+            local = labels[cells]
+            order = _np.argsort(local, kind='stable')
+            starts = _np.searchsorted(local[order], _np.arange(len(roots)))
+            order = cells[order]
+            keys = _corner_keys(order // h, order % h, m)
+            if len(roots):
+                keys = _np.maximum.reduceat(keys, starts)
+            self._size = _np.diff(_np.append(starts, len(order))).astype(_np.int32)
+            self._run = _slide_runs(code == _WHITE)
+        else:
+            #the corners of a block crossing a seam are the extremes of the
+            #corners of its pieces, as in _squash_corners
+            keys = _np.full((len(roots), 8), -1, _np.int64)
+            self._size = _np.zeros(len(roots), _np.int32)
+            for broots, bkeys, bsize in bands:
+                piece = labels[broots]
+                _np.maximum.at(keys, piece, bkeys)
+                _np.add.at(self._size, piece, bsize)
+        self._corners = _keyed_corners(keys, m, cs)
+
+    def _lex_stream(self, filename):
+        """
+        Runs the lexing algorithm over horizontal strips of the image, so
+        that only one strip of pixels is held in memory at a time.  Each strip
+        is classified and labeled as in the numpy engine, but blocks get
+        provisional labels which are only unified across the seams between
+        strips once the last strip has been read.  We keep
+            * per-block summaries: sizes, colors and corner keys
+            * the runs of each codel row, as the flat index (y*w + x) of the
+                first codel of each run and its (provisional) label -- every
+                row starts a fresh run, and the horizontal sliding extents are
+                simply the ends of the white runs
+            * the white runs of each codel column, as the flat indices
+                (x*h + y) of their first and last codels
+        and look codels up with a binary search over those runs.
+        """
+        cs = self._opinions['codel_size']
+        (self.X, self.Y), strips = _read_strips(filename, cs, self._opinions['strip'])
+        self._w = w = -(-self.X//cs)
+        self._h = h = -(-self.Y//cs)
+        m = max(w, h) + 1
+
+        count = 0
+        keys, sizes, colors = [], [], []
+        runkey, runlab = [], []
+        vstart, vend = [], []
+        seam0, seam1 = [], []
+        last = None
+        lastwhite = _np.zeros(w, bool)
+        for j0, pixels in strips:
+            code = self._classify(pixels)
+            hs = code.shape[1]
+            parent = _components(code)
+            flat = code.ravel()
+            iscode = flat < _WHITE
+            cells = _np.flatnonzero(iscode)
+            roots = _np.flatnonzero(iscode & (parent == _np.arange(w*hs)))
+            n = len(roots)
+            local = _np.searchsorted(roots, parent[cells])
+            labels = _np.full(w*hs, _BLOCKED, _np.int64)
+            labels[flat == _WHITE] = _SLIDING
+            labels[cells] = local + count
+            order = _np.argsort(local, kind='stable')
+            starts = _np.searchsorted(local[order], _np.arange(n))
+            order = cells[order]
+            if n:
+                keys.append(_np.maximum.reduceat(_corner_keys(order // hs, order % hs + j0, m), starts))
+            sizes.append(_np.diff(_np.append(starts, len(order))))
+            colors.append(flat[roots])
+            labels = labels.reshape(w, hs)
+
+            #blocks which continue over the seam are merged later
+            if last is not None:
+                lastcode, lastlabels = last
+                seam = (lastcode == code[:, 0]) & (lastcode < _WHITE)
+                seam0.append(lastlabels[seam])
+                seam1.append(labels[seam, 0])
+
+            rows = labels.T
+            change = _np.ones(rows.shape, bool)
+            change[:, 1:] = rows[:, 1:] != rows[:, :-1]
+            jj, ii = _np.nonzero(change)
+            runkey.append((jj + j0)*w + ii)
+            runlab.append(rows[jj, ii])
+
+            #white runs of columns start below nonwhite codels and end above
+            #them; a run still open at the bottom of a strip is closed by a
+            #later strip
+            white = code == _WHITE
+            above = _np.concatenate((lastwhite[:, None], white[:, :-1]), axis=1)
+            ii, jj = _np.nonzero(white & ~above)
+            vstart.append(ii*h + jj + j0)
+            ii, jj = _np.nonzero(white[:, :-1] & ~white[:, 1:])
+            ii = _np.concatenate((_np.flatnonzero(lastwhite & ~white[:, 0]), ii))
+            jj = _np.concatenate((_np.full(len(ii) - len(jj), -1), jj))
+            vend.append(ii*h + jj + j0)
+
+            lastwhite = white[:, -1].copy()
+            last = code[:, -1].copy(), labels[:, -1].copy()
+            count += n
+        vend.append(_np.flatnonzero(lastwhite)*h + h - 1)
+
+        #unify the provisional labels, and reduce their summaries
+        parent = _np.arange(count)
+        if seam0:
+            parent = _hook(parent, _np.concatenate(seam0), _np.concatenate(seam1))
+        roots = _np.flatnonzero(parent == _np.arange(count))
+        merged = _np.full((count, 8), -1, _np.int64)
+        if count:
+            _np.maximum.at(merged, parent, _np.concatenate(keys))
+        corners = _keyed_corners(merged[roots], m, cs)
+        size = _np.zeros(count, _np.int64)
+        _np.add.at(size, parent, _np.concatenate(sizes))
+
+        #label blocks in order of their first codel, as the other engines do
+        first = corners[:, _CORNERS.index((2, 1))] // cs
+        order = _np.argsort(first[:, 0]*h + first[:, 1], kind='stable')
+        final = _np.empty(count, _np.int32)
+        final[roots[order]] = _np.arange(len(roots))
+        final = final[parent]
+
+        runlab = _np.concatenate(runlab)
+        iscode = runlab >= 0
+        runlab[iscode] = final[runlab[iscode]]
+        self._runlab = runlab.astype(_np.int32)
+        self._runkey = _np.concatenate(runkey)
+        self._vstart = _np.sort(_np.concatenate(vstart))
+        self._vend = _np.sort(_np.concatenate(vend))
+        self._corners = corners[order]
+        self._size = size[roots][order].astype(_np.int32)
+        self._color = _np.concatenate(colors)[roots][order]
+
+    def _load(self, filename, box=None):
+        """Opens an image and returns its codes, one per codel, in a grid
+        indexed as code[x, y] -- restricted to the codels (i, j) with
+        i0 <= i < i1 and j0 <= j < j1 if box = (i0, j0, i1, j1) is given.
+        Palette images are classified an entry of the palette at a time, and
+        their index plane is looked up in the result, without ever converting
+        the image to RGB.  Binary PPM and PAM files are memory-mapped rather
+        than decoded (see _mapped)"""
+        cs = self._opinions['codel_size']
+        i0, j0, i1, j1 = (0, 0, None, None) if box is None else (c*cs for c in box)
+        crop = slice(j0, j1, cs), slice(i0, i1, cs)
+        pixels = _mapped(filename)
+        if pixels is not None:
+            self.X, self.Y = pixels.shape[1::-1]
+            return self._classify(pixels[crop].transpose(1, 0, 2))
+        image = _Image.open(filename)
+        self.X, self.Y = image.size
+        if image.mode == 'P':
+            lut = self._classify(_palette_rgb(image)[None])[0]
+            return lut[_np.asarray(image)[crop].T]
+        return self._classify(_np.asarray(image.convert("RGB"))[crop].transpose(1, 0, 2))
+
+    def _classify(self, pixels):
+        """Classifies an array of (r, g, b) pixels into codes: one of the 18
+        programming colors, _WHITE or _BLACK.  The distinct colors of the
+        pixels form a palette, which is classified in one step by _palette."""
+        pixels = pixels.astype(_np.int32)
+        packed = (pixels[..., 0] << 16) | (pixels[..., 1] << 8) | pixels[..., 2]
+        colors, inverse = _np.unique(packed, return_inverse=True)
+        lut = _palette(colors, self._opinions['noncoding'])
+        return lut[inverse.reshape(-1)].reshape(packed.shape)
 
     def _process_opinions(self):
         """Process the opinions dictionary to ensure that the behavior of
         this class is appropriate.  A more standard approach would be to
         use a factory which dispatches class mixins.  Maybe later."""
-        opinion = self._opinions['noncoding']
-        if opinion == 'block':
-            def kind(_self, c):
-                if c == _SLIDE: return 'slide', _SLIDE
-                elif c in _HL:  return 'code', c
-                else:           return 'block', _BLOCK
-        elif opinion == 'slide':
-            def kind(_self, c):
-                if c == _BLOCK: return 'block', _BLOCK
-                elif c in _HL:  return 'code', c
-                else:           return 'slide', _SLIDE
-        elif opinion == 'round':
-            def kind(_self, c):
-                if c == _BLOCK:   return 'block', _BLOCK
-                elif c == _SLIDE: return 'slide', _SLIDE
-                else:
-                    return ('code',
-                             min( ((c[0]-d[0])**2+(c[1]-d[1])**2+(c[2]-d[2])**2, d)
-                                for d in _HL)[1])
-        self._kind = k = kind.__get__(self, self.__class__)
-
-    def _find(self, p0, rank = None):
-        """mostly standard find. rank is ephemeral because we only
-        need it in the initialization phase """
-        try:
-            p = self._parent[p0]
-        except KeyError:
-            self._parent[p0] = p0
-            rank[p0] = 1
-            return p0
-        if p != p0:
-            p = self._parent[p0] = self._find(p)
+        engine = self._opinions['lexer']
+        if engine == 'numpy':
+            self._lex = self._lex_numpy
+        elif engine == 'lazy':
+            #blocks and slides are lexed when they're first encountered
+            self._lex = self._lex_lazy
+            self.at = self._at_lazy
+            self.slide = self._slide_lazy
+        elif engine == 'stream':
+            #blocks and slides are looked up in runs rather than grids
+            self._lex = self._lex_stream
+            self.at = self._at_runs
+            self.slide = self._slide_runs_at
+        else:
+            self._lex = self._lex_python
+
+    def _find(self, parent, i):
+        """mostly standard find, with path halving.  parent is ephemeral
+        because we only need it in the initialization phase"""
+        p = parent[i]
+        while p != i:
+            parent[i] = q = parent[p]
+            i, p = p, q
         return p
 
-    def _union(self, p0, p1, rank, corners):
-        """mostly standard union... but in addition to computing rank we
-        also locate the block's corners. rank and corners are ephemeral
-        because they're only needed during initialization"""
-        r0 = self._find(p0, rank)
-        r1 = self._find(p1, rank)
+    def _union(self, parent, i0, i1, size, corners, h, cs):
+        """mostly standard union... but in addition to computing size we
+        also locate the block's corners.  size and corners are ephemeral
+        because they're only needed during initialization, and only
+        contain entries for roots of nontrivial sets"""
+        r0 = self._find(parent, i0)
+        r1 = self._find(parent, i1)
         if r0 == r1:
             return
-        if rank[r0] < rank[r1]:
+        s0 = size.pop(r0, 1)
+        s1 = size.pop(r1, 1)
+        if s0 < s1:
             root = r1
             prev = r0
         else:
             root = r0
             prev = r1
 
-        self._parent[prev] = root
-        rank[root] += rank[prev]
-        corners[root] = _squash_corners(root, prev, corners)
+        parent[prev] = root
+        size[root] = s0 + s1
+        p0 = (root//h)*cs, (root%h)*cs
+        p1 = (prev//h)*cs, (prev%h)*cs
+        corners[p0] = _squash_corners(p0, p1, corners)
+        corners.pop(p1, None)
 
 def _squash_corners(p0, p1, corners):
     """compute the corners of the just-merged roots p0 and p1.
@@ -206,3 +707,298 @@ def _select_corner(d, c, p, q):
     #get one, eventually?
     bitaddr = c + 2*(p[0]<q[0]) + 4*(p[0]>q[0]) + 8*(p[1]<q[1]) + 16*(p[1]>q[1])
     return q if (_cornertable[d] >> bitaddr)&1 else p
+
+#codes used in the lexer's tables: the programming colors are 0 through 17;
+#white and black follow them
+_COLORS = sorted(_HL) + [_SLIDE, _BLOCK]
+_CODE = {c: i for i, c in enumerate(_COLORS)}
+_WHITE, _BLACK = _CODE[_SLIDE], _CODE[_BLOCK]
+
+#the colors of the codes packed as 0xrrggbb, sorted for searching
+_PACKED = _np.array([(r << 16) | (g << 8) | b for r, g, b in _COLORS])
+_SEARCH = _np.argsort(_PACKED)
+_RGB = _np.array(sorted(_HL))
+
+def _palette(colors, noncoding):
+    """Classifies an array of distinct colors packed as 0xrrggbb into codes,
+    according to the noncoding opinion: nonstandard colors become _BLACK
+    ('block'), _WHITE ('slide') or the nearest programming color ('round',
+    breaking ties towards the least (r, g, b) tuple)"""
+    where = _SEARCH[_np.searchsorted(_PACKED[_SEARCH], colors).clip(0, len(_PACKED) - 1)]
+    odd = _PACKED[where] != colors
+    code = where.astype(_np.uint8)
+    if noncoding == 'round':
+        rgb = (colors[odd, None] >> _np.array([16, 8, 0])) & 255
+        code[odd] = (((rgb[:, None, :] - _RGB)**2).sum(axis=2)).argmin(axis=1)
+    else:
+        code[odd] = _BLACK if noncoding == 'block' else _WHITE
+    return code
+
+#labels of non-block codels in the lexer's label grid, and of codels which
+#the lazy engine has yet to reach
+_BLOCKED, _SLIDING, _UNLEXED = -1, -2, -3
+
+#the order of the (d, c) corners in the corner table
+_CORNERS = tuple(_product((0, 1, 2, 3), (0, 1)))
+
+#codel steps, indexed by direction
+_STEPS = ((1, 0), (0, 1), (-1, 0), (0, -1))
+
+#the (d, c)-most point of a block maximizes the primary projection, then the
+#secondary projection -- each given as the coefficients of (x, y)
+_CORNERKEYS = {(0, 0): ((1, 0), (0, -1)), (0, 1): ((1, 0), (0, 1)),
+               (1, 0): ((0, 1), (1, 0)), (1, 1): ((0, 1), (-1, 0)),
+               (2, 0): ((-1, 0), (0, 1)), (2, 1): ((-1, 0), (0, -1)),
+               (3, 0): ((0, -1), (-1, 0)), (3, 1): ((0, -1), (1, 0))}
+_PRIMARY, _SECONDARY = (_np.array([_CORNERKEYS[c][i] for c in _CORNERS]) for i in (0, 1))
+
+def _corner_keys(xs, ys, m):
+    """Packs the primary and secondary projections of the codels (xs, ys)
+    for each corner into a single integer, whose maximum over the codels of a
+    block locates that corner.  Codel indices must be less than m.  Returns
+    an array of shape (len(xs), 8)"""
+    xs, ys = xs[:, None], ys[:, None]
+    P = _PRIMARY[:, 0]*xs + _PRIMARY[:, 1]*ys + m
+    S = _SECONDARY[:, 0]*xs + _SECONDARY[:, 1]*ys + m
+    return P*(2*m) + S
+
+def _keyed_corners(keys, m, cs):
+    """Unpacks corner keys into a corner table, of shape (len(keys), 8, 2)
+    -- the projections are orthogonal, so we invert them by transposing"""
+    P, S = keys // (2*m) - m, keys % (2*m) - m
+    corners = _np.empty(keys.shape + (2,), _np.int32)
+    for i in (0, 1):
+        corners[..., i] = (P*_PRIMARY[:, i] + S*_SECONDARY[:, i])*cs
+    return corners
+
+def _palette_rgb(image):
+    """Returns the palette of a palette-mode image as a (256, 3) array, padded
+    with black"""
+    rgb = _np.zeros((256, 3), _np.uint8)
+    palette = _np.array(image.getpalette('RGB'), _np.uint8).reshape(-1, 3)
+    rgb[:len(palette)] = palette[:256]
+    return rgb
+
+def _read_strips(filename, cs, rows):
+    """Opens an image to be read in strips of (up to) rows codel rows, one
+    pixel per codel.  Returns the size of the image and a generator of pairs
+    (j, pixels), where j is the first codel row of the strip and pixels is
+    an array of shape (w, rows, 3) indexed as pixels[x, y].  Binary PPM and
+    PAM files are memory-mapped, so only the pages of each strip are read
+    as it's needed; other formats are decoded with PIL"""
+    pixels = _mapped(filename)
+    if pixels is None:
+        pixels = _np.asarray(_Image.open(filename).convert("RGB"))
+    Y, X = pixels.shape[:2]
+    pixels = pixels[::cs, ::cs].transpose(1, 0, 2)
+    strips = ((j, pixels[:, j:j+rows]) for j in range(0, pixels.shape[1], rows))
+    return (X, Y), strips
+
+def _detect_codel_size(filename):
+    """Infers the codel size of an image as the greatest common divisor of
+    the lengths of its color runs along rows and columns -- that is, of the
+    positions where the color changes, and the size of the image.  The image
+    is scanned in strips, as the stream engine reads it"""
+    (X, Y), strips = _read_strips(filename, 1, 256)
+    size = _np.gcd(X, Y)
+    last = None
+    for j, pixels in strips:
+        pixels = pixels.astype(_np.int32)
+        packed = (pixels[..., 0] << 16) | (pixels[..., 1] << 8) | pixels[..., 2]
+        xs = _np.flatnonzero((packed[1:] != packed[:-1]).any(axis=1)) + 1
+        ys = _np.flatnonzero((packed[:, 1:] != packed[:, :-1]).any(axis=0)) + 1 + j
+        size = _np.gcd.reduce(_np.concatenate(([size], xs, ys)))
+        if last is not None and (last != packed[:, 0]).any():
+            size = _np.gcd(size, j)
+        last = packed[:, -1]
+        if size == 1:
+            break
+    return int(size)
+
+def _mapped(filename):
+    """Memory-maps a binary PPM or PAM file with 8-bit RGB (or RGB_ALPHA)
+    channels, returning a read-only array of shape (Y, X, 3) viewing its
+    pixels -- or None, for any other file"""
+    with open(filename, 'rb') as f:
+        magic = f.read(2)
+        header = _ppm_header(f) if magic == b'P6' else _pam_header(f) if magic == b'P7' else None
+    if header is None:
+        return None
+    X, Y, depth, offset = header
+    return _np.memmap(filename, _np.uint8, 'r', offset, (Y, X, depth))[..., :3]
+
+def _ppm_header(f):
+    """Parses the header of a binary PPM file with 8-bit channels, following
+    its magic number, returning (width, height, depth, offset of the pixel
+    data), or None if the file isn't supported"""
+    fields = []
+    c = f.read(1)
+    while len(fields) < 3:
+        if c == b'#':
+            while c not in b'\r\n':
+                c = f.read(1)
+        elif c.isspace():
+            c = f.read(1)
+        elif c.isdigit():
+            field = b''
+            while c.isdigit():
+                field, c = field + c, f.read(1)
+            fields.append(int(field))
+        else:
+            return None
+    X, Y, maxval = fields
+    #exactly one whitespace character separates the header from the data
+    return (X, Y, 3, f.tell()) if maxval == 255 and c.isspace() else None
+
+def _pam_header(f):
+    """Parses the header of a PAM file, following its magic number, returning
+    (width, height, depth, offset of the pixel data), or None if the file
+    isn't RGB or RGB_ALPHA with 8-bit channels"""
+    fields = {}
+    for line in f:
+        line = line.split(b'#')[0].split()
+        if line == [b'ENDHDR']:
+            break
+        if line:
+            fields[line[0]] = line[1:]
+    try:
+        X, Y, depth, maxval = (int(fields[k][0]) for k in (b'WIDTH', b'HEIGHT', b'DEPTH', b'MAXVAL'))
+    except (KeyError, IndexError, ValueError):
+        return None
+    tupltype = b' '.join(fields.get(b'TUPLTYPE', ()))
+    if maxval != 255 or (depth, tupltype) not in ((3, b''), (3, b'RGB'), (4, b'RGB_ALPHA')):
+        return None
+    return X, Y, depth, f.tell()
+
+def _slide_runs(white):
+    """Computes the sliding extents of the (w, h) boolean grid white.
+    Returns a list of four grids, indexed by direction: the d-th grid holds,
+    at each white codel, the index along the d-ward axis of the last codel
+    of its white run in that direction.  Entries at nonwhite codels are
+    garbage.  Each axis is processed in a single pass over its runs, which
+    begin where a white codel follows a nonwhite one (or the edge) and end
+    where a nonwhite codel (or the edge) follows a white one."""
+    runs = [None]*4
+    dtype = _np.int16 if max(white.shape) < 2**15 else _np.int32
+    for d, grid in ((0, white), (1, white.T)):
+        n = len(grid)
+        pos = _np.arange(n, dtype=dtype).reshape(-1, 1)
+        start = grid.copy()
+        start[1:] &= ~grid[:-1]
+        end = grid.copy()
+        end[:-1] &= ~grid[1:]
+        first = _np.maximum.accumulate(_np.where(start, pos, dtype(-1)), axis=0)
+        last = _np.minimum.accumulate(_np.where(end, pos, dtype(n))[::-1], axis=0)[::-1]
+        runs[d], runs[d^2] = (last, first) if d == 0 else (last.T, first.T)
+    return runs
+
+def _lex_bands(code, bounds, m):
+    """Lexes the (w, h) grid code in bands of columns bounds[k] <= x <
+    bounds[k+1], one per process, for the numpy engine.  The grid, the
+    parent array and the sliding extents live in memory-mapped files which
+    the workers read and write in place (see _lex_band), so that nothing the
+    size of the image is pickled between processes.  Returns
+        * the parent array of _components, hooked across the seams
+        * a list of the (roots, corner keys, sizes) of the blocks of each
+            band, with roots as flat indices of the grid
+        * the sliding extents of _slide_runs, stitched across the seams"""
+    w, h = code.shape
+    dtype = _np.int16 if max(w, h) < 2**15 else _np.int32
+    bands = list(zip(bounds, bounds[1:]))
+    with _TemporaryDirectory() as tmp:
+        _np.save(_os.path.join(tmp, 'code.npy'), code)
+        _np.lib.format.open_memmap(_os.path.join(tmp, 'parent.npy'), 'w+', _np.int64, (w*h,)).flush()
+        for d in range(4):
+            _np.lib.format.open_memmap(_os.path.join(tmp, 'run%d.npy' % d), 'w+', dtype, (w, h)).flush()
+        with _ProcessPoolExecutor(len(bands)) as pool:
+            lexed = list(pool.map(_lex_band, [tmp]*len(bands), *zip(*bands), [m]*len(bands)))
+        parent = _np.load(_os.path.join(tmp, 'parent.npy'))
+        run = [_np.load(_os.path.join(tmp, 'run%d.npy' % d)) for d in range(4)]
+
+    seams = _np.array(bounds[1:-1])
+    left, right = code[seams-1], code[seams]
+    i, j = _np.nonzero((left == right) & (left < _WHITE))
+    seams = seams[i]*h + j
+    parent = _hook(parent, seams - h, seams)
+
+    #a white run crossing a seam continues the run on its far side -- the
+    #seams are visited in the direction of the slide, so that runs crossing
+    #several bands reach their far ends
+    white = code == _WHITE
+    for x0, x in reversed(bands[:-1]):
+        across = white[x-1] & white[x]
+        band = run[0][x0:x, across]
+        run[0][x0:x, across] = _np.where(band == x-1, run[0][x, across], band)
+    for x, x1 in bands[1:]:
+        across = white[x-1] & white[x]
+        band = run[2][x:x1, across]
+        run[2][x:x1, across] = _np.where(band == x, run[2][x-1, across], band)
+    return parent, lexed, run
+
+def _lex_band(tmp, x0, x1, m):
+    """Lexes the band of columns x0 <= x < x1 of the grid saved by
+    _lex_bands in the directory tmp, writing its parents and sliding extents
+    into the shared grids there.  Returns the roots, corner keys and sizes of
+    the blocks of the band"""
+    code = _np.load(_os.path.join(tmp, 'code.npy'), mmap_mode='r')[x0:x1]
+    w, h = code.shape
+    parent = _components(code)
+    iscode = code.ravel() < _WHITE
+    cells = _np.flatnonzero(iscode)
+    roots = _np.flatnonzero(iscode & (parent == _np.arange(w*h)))
+    local = _np.searchsorted(roots, parent[cells])
+    order = _np.argsort(local, kind='stable')
+    starts = _np.searchsorted(local[order], _np.arange(len(roots)))
+    order = cells[order]
+    keys = _corner_keys(order // h + x0, order % h, m)
+    if len(roots):
+        keys = _np.maximum.reduceat(keys, starts)
+    size = _np.diff(_np.append(starts, len(order)))
+
+    shared = _np.load(_os.path.join(tmp, 'parent.npy'), mmap_mode='r+')
+    shared[x0*h:x1*h] = parent + x0*h
+    shared.flush()
+    for d, run in enumerate(_slide_runs(code == _WHITE)):
+        shared = _np.load(_os.path.join(tmp, 'run%d.npy' % d), mmap_mode='r+')
+        shared[x0:x1] = run
+        if d&1 == 0:
+            shared[x0:x1] += x0
+        shared.flush()
+    return roots + x0*h, keys, size
+
+def _components(code):
+    """Returns a parent array over the flattened (w, h) grid code, in which
+    each programming-colored cell points at the smallest flat index of its
+    cardinally-connected, equally-coded component"""
+    w, h = code.shape
+    index = _np.arange(w*h).reshape(w, h)
+    code = code.astype(_np.int16)
+    right = (code[:-1, :] == code[1:, :]) & (code[:-1, :] < _WHITE)
+    down = (code[:, :-1] == code[:, 1:]) & (code[:, :-1] < _WHITE)
+    a = _np.concatenate((index[:-1, :][right], index[:, :-1][down]))
+    b = _np.concatenate((index[1:, :][right], index[:, 1:][down]))
+    return _hook(index.ravel(), a, b)
+
+def _hook(parent, a, b):
+    """A vectorized union-find: merges the sets containing a[i] and b[i]
+    for each i, where parent is an array in which every element is a root.
+    On each round the larger root of every edge is hooked onto the smaller
+    before the whole forest is compressed by pointer jumping, so a round
+    takes linear time.  Blocks with short paths between their codels settle
+    in a few rounds, but the number of rounds isn't bounded by a logarithm
+    -- a long snaking block can take a round per turn.  Returns the new
+    parent array, in which every element points at the smallest element of
+    its set."""
+    while len(a):
+        pa, pb = parent[a], parent[b]
+        keep = pa != pb
+        a, b, pa, pb = a[keep], b[keep], pa[keep], pb[keep]
+        if not len(a):
+            break
+        _np.minimum.at(parent, _np.maximum(pa, pb), _np.minimum(pa, pb))
+        while True:
+            grand = parent[parent]
+            if _np.array_equal(grand, parent):
+                break
+            parent = grand
+    return parent
@@ -0,0 +1,142 @@
+from repiet.parser import Parser as _Parser
+from repiet.tracer import Tracer as _Tracer
+from repiet.optimizer import StaticEvaluator as _StaticEvaluator
+from repiet.ir import IR as _IR
+from repiet.util import Node as _Node
+
+class Minimizer:
+    """
+    A minimizer for parse graphs.  We take the Nodes output by a Parser,
+    Tracer or StaticEvaluator, and merge the Nodes which behave identically
+    -- those with the same operations, whose destinations behave identically
+    in turn.  For example, the same loop body is often reached under several
+    (dp, cc) states, and each copy would otherwise be compiled separately.
+
+    Treating a parse graph as a DFA, whose states are Nodes and whose letters
+    are the indices of destinations, this is DFA minimization: we start by
+    partitioning the Nodes by their operations and number of destinations,
+    and refine the partition with Hopcroft's algorithm until the destinations
+    of every Node in a block fall in the same blocks.  This takes O(n log n)
+    time in the number of Nodes.
+
+    Minimizers have a similar interface to Parsers -- the name of the root is
+    M.root(), Node objects are fetched with M[name], and M.name(name) makes a
+    human-readable name, that of one of the merged Nodes.  Nodes are named by
+    dense integer ids.
+
+    The source is a Parser, Tracer, StaticEvaluator or IR, or anything a
+    StaticEvaluator can be built from -- an image filename or a Lexer.
+    """
+    #the optimization stage of the graph (see repiet.ir)
+    stage = 3
+
+    def __init__(self, source, **opinions):
+        prog = source if isinstance(source, (_Parser, _Tracer, _StaticEvaluator, _IR)) else _StaticEvaluator(source, **opinions)
+        self._prog = prog
+        self._graph = []
+        self._reps = []
+        if prog.root() is None:
+            self._root = None
+        else:
+            self._root = 0
+            self._minimize(prog)
+
+    def root(self):
+        """
+        Returns the root of the program.  If the program is trivial (that is,
+        returns immediately with no input or output), we return None
+        """
+        return self._root
+
+    def __getitem__(self, name):
+        """
+        Returns the Node associated with the input `name`, which must not be
+        None -- Nodes are of the same form as those of the source
+        """
+        return self._graph[name]
+
+    def flatten(self):
+        """
+        Returns all Node objects as a list
+        """
+        return list(self._graph)
+
+    def name(self, name):
+        """
+        Returns a human-readable string naming the Node `name`
+        """
+        return self._prog.name(self._reps[name])
+
+    def _minimize(self, prog):
+        """
+        Partitions the Nodes of prog into blocks of identically-behaving
+        Nodes, and builds the quotient graph -- numbering its Nodes in the
+        order they're reached from the root.
+        """
+        nodes = prog.flatten()
+        index = {node.name: i for i, node in enumerate(nodes)}
+        dests = [tuple(index[d] for d in node.dests) for node in nodes]
+
+        #inverse transitions: preds[c][q] lists the Nodes whose c'th
+        #destination is q
+        preds = [{} for _ in range(max(map(len, dests), default=0))]
+        for p, ds in enumerate(dests):
+            for c, q in enumerate(ds):
+                preds[c].setdefault(q, []).append(p)
+
+        #the initial partition, by operations and number of destinations
+        blocks = {}
+        for i, node in enumerate(nodes):
+            blocks.setdefault((node.ops, len(node.dests)), []).append(i)
+        blocks = [set(b) for b in blocks.values()]
+        block = [None]*len(nodes)
+        for b, members in enumerate(blocks):
+            for i in members:
+                block[i] = b
+
+        #Hopcroft's algorithm -- the worklist holds (block, letter) pairs
+        #whose predecessors may split other blocks
+        work = {(b, c) for b in range(len(blocks)) for c in range(len(preds))}
+        while work:
+            a, c = work.pop()
+            split = {}
+            for q in blocks[a]:
+                for p in preds[c].get(q, ()):
+                    split.setdefault(block[p], set()).add(p)
+            for b, inside in split.items():
+                members = blocks[b]
+                if len(inside) == len(members):
+                    continue
+                #keep the larger half as block b, and the smaller as a new one
+                small = inside if 2*len(inside) <= len(members) else members - inside
+                members -= small
+                n = len(blocks)
+                blocks.append(small)
+                for i in small:
+                    block[i] = n
+                for c2 in range(len(preds)):
+                    #if (b, c2) is pending, both halves must be; otherwise
+                    #the smaller half suffices -- either way, it's the new one
+                    work.add((n, c2))
+
+        #number the blocks from the root, as a quick graph traversal -- each
+        #block is represented by its first Node
+        graph = self._graph
+        order = [block[index[prog.root()]]]
+        ids = {order[0]: 0}
+        graph.append(None)
+        to_process = [order[0]]
+        while to_process:
+            b = to_process.pop()
+            rep = min(blocks[b])
+            dnames = []
+            for q in dests[rep]:
+                d = block[q]
+                if d not in ids:
+                    ids[d] = len(order)
+                    order.append(d)
+                    graph.append(None)
+                    to_process.append(d)
+                dnames.append(ids[d])
+            graph[ids[b]] = _Node(ids[b], nodes[rep].ops, tuple(dnames))
+        self._reps = [nodes[min(blocks[b])].name for b in order]
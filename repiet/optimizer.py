@@ -1,5 +1,6 @@
 from repiet.tracer import Tracer as _Tracer
-from repiet.util import Node as _Node
+from repiet.ir import IR as _IR
+from repiet.util import Node as _Node, Folded as _Folded, default_opinions as _default_opinions
 
 class StaticEvaluator:
     """
@@ -12,6 +13,9 @@ class StaticEvaluator:
         * str -- a 3-character opcode
     whereas the StaticEvaluator produces another type of operation,
         * (tuple, str) -- push the tuple onto the stack, and print the string
+    and, under the 'symbolic' evaluation opinion, values which can't be known
+    at compile time are named and computed with, producing
+        * Folded -- straight-line code over those values (see repiet.util)
 
     A Node is a namedtuple consisting of a name, a list of operations (each
     an int or a 3-character opcode; see parser.py), and a tuple of
@@ -22,19 +26,40 @@ class StaticEvaluator:
     program.
 
     StaticEvaluators have a similar interface to Parsers and Tracers -- the
-    name of the root is S.root(), and Node objects are fetched with S[name]
+    name of the root is S.root(), Node objects are fetched with S[name], and
+    S.name(name) makes a human-readable name.  A trace may be evaluated
+    twice: once when the stack is known to be empty (its "truestack"
+    version, whose human-readable name is suffixed by "_") and once when it
+    isn't.  Each version has its own dense integer id.
 
-    The analysis performed by this class can take quadratic time in the total
+    The analysis performed by this class takes linear time in the total
     number of operations contained in the output of the Tracer -- which can
-    ultimately be linear in the number of pixels contained in the image.
-    """
-    def __init__(self, filename, **opinions):
-        self._traces = {}
+    ultimately be linear in the number of pixels contained in the image.  The
+    'budget' opinion bounds the number of operations simulated from each
+    entry point.
 
-        tracer = _Tracer(filename, **opinions)
-        self._root = tracer.root()
-        if self._root is not None:
+    The source is a Tracer (or an IR of one), or anything a Tracer can be
+    built from -- an image filename, a Lexer or a Parser.
+    """
+    #the optimization stage of the graph (see repiet.ir)
+    stage = 2
+
+    def __init__(self, source, **opinions):
+        self._traces = []
+        self._keys = []
+        self._ids = {}
+        _opinions = _default_opinions(**opinions)
+        self._budget = _opinions['budget']
+        self._symbolic = _opinions['evaluation'] == 'symbolic'
+
+        tracer = source if isinstance(source, _Tracer) or isinstance(source, _IR) and source.stage == 1 else _Tracer(source, **opinions)
+        self._tracer = tracer
+        if tracer.root() is None:
+            self._root = None
+        else:
+            self._root = self._id((tracer.root(), True))
             self._evaluate(tracer)
+        del self._ids
 
     def root(self):
         """
@@ -54,6 +79,7 @@ class StaticEvaluator:
                 * a 3-character opcode
                 * an int to be pushed on the stack
                 * a pair (tuple, str) of produced through static evaluation
+                * a Folded operation, likewise
             * a tuple of destination names
 
         If the final operation is "PTR" or "SWT" there will be 4 or 2
@@ -68,25 +94,48 @@ class StaticEvaluator:
         """
         Returns all Node objects as an list
         """
-        return list(self._traces.values())
+        return list(self._traces)
+
+    def name(self, name):
+        """
+        Returns a human-readable string naming the Node `name`
+        """
+        trace, truestack = self._keys[name]
+        return _rename(self._tracer.name(trace), truestack)
+
+    def _id(self, key):
+        """
+        Returns the id of the pair (trace, truestack), numbering it if it's
+        new
+        """
+        name = self._ids.get(key)
+        if name is None:
+            name = self._ids[key] = len(self._keys)
+            self._keys.append(key)
+            self._traces.append(None)
+        return name
 
     def _evaluate(self, tracer):
         """
-        Runs _eval on the traces with a quick graph traversal algorithm
+        Runs _eval on the traces with a worklist algorithm.  Nodes are named
+        by the trace they begin with and whether the stack is known to be
+        empty at that point; the destinations of a Node are entered with the
+        stack state that the Node leaves.  Each of these entry states is
+        evaluated once, and the evaluation of one entry reuses the others --
+        it jumps to them wherever it has nothing on hand to fold.
         """
         traces = self._traces
         #I'm sick of apologizing for this -- what an awesome stack!
-        to_process = (self._root, True), ()
+        to_process = self._root, ()
         while to_process:
-            (name, truestack), to_process = to_process
-            trace = tracer[name]
-            ops, dests, truestack = self._eval(tracer, trace, truestack)
-            dests = [_rename(d, truestack) for d in dests]
-            truename = _rename(name, truestack)
-            traces[truename] = _Node(truename, tuple(ops), tuple(dests))
+            name, to_process = to_process
+            trace, truestack = self._keys[name]
+            ops, dests, truestack = self._eval(tracer, tracer[trace], truestack)
+            dests = tuple(self._id((d, truestack)) for d in dests)
+            traces[name] = _Node(name, tuple(ops), dests)
             for dest in dests:
-                if dest not in traces:
-                    to_process = (dest, truestack), to_process
+                if traces[dest] is None:
+                    to_process = dest, to_process
 
     def _eval(self, tracer, trace, truestack):
         """
@@ -95,20 +144,34 @@ class StaticEvaluator:
         determined at compile time, are reproduced verbatim in the returned
         Node.  The remainder are executed by the virtual machine, and their
         results are collected into a stack and an output string.
+
+        We only carry on into the following traces while the virtual machine
+        holds something to fold into them, and at most budget operations are
+        simulated before we wrap up and jump -- so the total work is linear
+        in the number of traced operations.
         """
 
         #list of operations in the static-eval'd trace
         ops = []
         def finish():
             end = vm.finish()
+            if isinstance(end, _Folded):
+                #a fold which is no shorter than the operations it was made
+                #of isn't worth the guard -- put those back instead
+                if end.depth + len(end.effects) + len(end.stack) < len(end.ops):
+                    ops.append(end)
+                else:
+                    ops.extend(end.ops)
+                return truestack and not end.stack
             if any(end): ops.append(end)
             return truestack and not end[0]
+        symbolic = self._symbolic
 
         #list of states we've encountered
         hits = {(trace.name, trace.name, truestack)}
         vm = None
+        steps = 0
         while True:
-            print(" entering trace {}, truestack is".format(trace.name, truestack))
             dests = trace.dests
             #we skip the PTR and SWT operations here -- the vm can't handle
             #them... I promise to put it back!
@@ -118,19 +181,18 @@ class StaticEvaluator:
             else:
                 traceops = trace.ops[:-1]
                 final = trace.ops[-1]
-            traceops = trace.ops if len(dests) <= 1 else trace.ops[:-1]
             for op in traceops:
+                if vm is None and (symbolic or isinstance(op, int)):
+                    #only start up a vm on a PSH -- unless we're working
+                    #with symbols, which can come from anywhere but a
+                    #truly empty stack
+                    vm = _PPVM(inputs=symbolic, underflow=symbolic and not truestack, bottom=truestack)
                 if vm is None:
-                    #only start up a vm on a PSH
-                    if isinstance(op, int):
-                        print("   firing up a VM")
-                        vm = _PPVM()
-                        vm.eval(op)
-                    elif op in ("CIN", "DIN") or not truestack:
+                    if op in ("CIN", "DIN") or not truestack:
                         ops.append(op)
                         truestack = False
                 elif not vm.eval(op): #we've got a running vm; hit it!
-                    if truestack and op not in ("CIN", "DIN"):
+                    if truestack and vm.short:
                         #We tried to perform an op on a truly empty stack... chuck
                         #it out and keep on truckin'
                         continue
@@ -141,39 +203,41 @@ class StaticEvaluator:
                         ops.append(op)
                         vm = None
                         truestack = False
+            steps += len(traceops)
 
             if vm is not None:
-                if (vm.stack or truestack) and len(dests) > 1:
+                if len(dests) > 1 and not vm.depth and (isinstance(vm.stack[-1], int) if vm.stack else truestack):
                     #here, we've got the opportunity to simplify PTR and SWT
                     #operations -- I know I promised to "put it back" but this is
                     #my opportunity to gobble up more program.  Instead, we perform
                     #the operation and keep going.
-                    i = (vm.stack.pop() if vm.stack else 0) % len(dests)
-                    dest = dests[i]
-                    #and here's where we remember to be careful about going in
-                    #cycles.  we can visit any given trace up to 4 times, provided
-                    #that it exits to a different trace each time
-                    if (trace.name, dest, truestack) in hits:
-                        return ops, (dest,), finish()
+                    if vm.stack:
+                        i = vm.stack.pop()
+                        #should a Folded operation fall back on the ops it
+                        #was made from, they'll need to pop this too
+                        vm.ops.append('POP')
                     else:
-                        hits.add((trace.name, dest, truestack))
-                        #fetch the next trace and keep going
-                        trace = tracer[dest]
-                elif len(dests) > 1:
-                    #we want to pop from an apparently (but not provably) empty stack.
-                    #put the final conditional back, and quit evaluating
-                    return ops, dests, finish()
+                        i = 0
+                    dest = dests[i % len(dests)]
                 elif len(dests) == 1:
                     dest, = dests
-                    if (trace.name, dest, truestack) in hits:
-                        end = vm.finish()
-                        if any(end): ops.append(end)
-                        return ops, (dest,), (truestack and not end[0])
-                    else:
-                        hits.add((trace.name, dest, truestack))
-                        trace = tracer[dest]
                 else:
-                    return ops, dests, finish()
+                    #either we halt, or we want to pop from an apparently (but
+                    #not provably) empty stack.  put the final conditional
+                    #back, and quit evaluating
+                    truestack = finish()
+                    if final is not None:
+                        ops.append(final)
+                    return ops, dests, truestack
+                #and here's where we remember to be careful about going in
+                #cycles.  we can visit any given trace up to 4 times, provided
+                #that it exits to a different trace each time -- and we don't
+                #go on past our budget
+                if (trace.name, dest, truestack) in hits or steps > self._budget:
+                    return ops, (dest,), finish()
+                hits.add((trace.name, dest, truestack))
+                #fetch the next trace and keep going
+                trace = tracer[dest]
             else:
                 if final is not None:
                     if truestack:
@@ -182,29 +246,46 @@ class StaticEvaluator:
                     else:
                         #otherwise we put the final op back
                         ops.append(final)
-                if len(dests) != 1 or (trace.name, dests[0], truestack) in hits:
-                    return ops, dests, truestack
-                else:
-                    hits.add((trace.name, dests[0], truestack))
-                    #fetch the next trace and keep going
-                    trace = tracer[dests[0]]
+                #there's nothing to fold into the next trace, so we jump to
+                #it -- its evaluation is shared by everything that gets there
+                return ops, dests, truestack
 
 def _rename(name, truestack):
     if truestack:
         return name+"_"
     return name
 
-def _check(n):
+def _check(n, pure=False):
     """
     This is a method decorator that checks before executing an operation. The
     decorated method returns True if the operator's impact is known at
     runtime, and False otherwise.  The decorator removes the values from the
-    stack and passes them on to the original method.    
+    stack and passes them on to the original method.
+
+    Pure operations on symbolic values (see _PPVM) aren't run -- they push
+    an expression (opcode, *args) instead, where the args are taken in stack
+    order (so the top of the stack comes last).
     """
     def dec(f):
         def _(self):
-            if len(self.stack) < n:
+            if not self._take(n):
                 return False
+            args = self.stack[-n:]
+            if pure and not all(isinstance(x, int) for x in args):
+                if f.__name__ in ('DVD', 'MOD') and not isinstance(args[-1], int):
+                    #we can't rule out a division by zero
+                    return False
+                elif f.__name__ in ('DVD', 'MOD') and not args[-1]:
+                    del self.stack[-n:]
+                    return True
+                expr = (f.__name__,) + tuple(args)
+                if _size(expr) > _EXPRESSION_SIZE:
+                    #DPL makes it easy to build expressions exponentially
+                    #large, once written out
+                    return False
+                del self.stack[-n:]
+                self.stack.append(expr)
+                return True
             args = [self.stack.pop() for _ in range(n)]
             res = f(self, *args)
             if res is not None:
@@ -213,6 +294,13 @@ def _check(n):
         return _
     return dec
         
+#the largest expression _PPVM will build, counting every value and symbol --
+#and the most symbols it will pull up from beneath the stack
+_EXPRESSION_SIZE = 64
+
+def _size(x):
+    return 1 + sum(map(_size, x[1:])) if isinstance(x, tuple) else 1
+
 class _PPVM(object):
     """~~~~~~~~~~ Proving Piet Virtual Machine ~~~~~~~~~
     Just like a Piet virtual machine, but buffers output
@@ -220,11 +308,27 @@ class _PPVM(object):
     This is used for static analysis -- operations on a
     nonempty stack are performed at compile time until a
     cycle is encountered or an exit condition is hit.
+
+    In symbolic mode, it doesn't stop there: values read
+    from the input become symbols ('i', n) for the n'th
+    read, and (with underflow) values popped from beneath
+    the known stack become symbols ('s', k) for the k'th
+    value of the stack it started on (('s', 1) is the
+    top).  Arithmetic on symbols builds expressions.
+    With bottom, the stack is known to be the whole of
+    the runtime stack.
     """
 
-    def __init__(self, ops=()):
+    def __init__(self, ops=(), inputs=False, underflow=False, bottom=False):
         self.stack = []
-        self.outputs = []
+        self.effects = []
+        self.ops = []
+        self.inputs = inputs
+        self.underflow = underflow
+        self.bottom = bottom
+        self.depth = 0
+        self.reads = 0
+        self.short = False
         for i, op in enumerate(ops):
             if not self.eval(op):
                 raise RuntimeError('failed to evaluate\n%s\n%s\n%s'%(ops, (i, op), self.stack))
@@ -234,20 +338,47 @@ class _PPVM(object):
         Evaluate a single operation.  SWT and PTR are not handled here.
         This function returns False in the cases that
             * an operation needs a deeper stack than we've currently got
+              (in which case self.short is set)
             * an operation requires runtime input from the user
+            * an operation can't be performed on symbols
         """
+        self.short = False
         if isinstance(op, int):
             self.stack.append(op)
-            return True
-        else:
-            return self.__getattribute__(op)()
+        elif not self.__getattribute__(op)():
+            return False
+        self.ops.append(op)
+        return True
 
     def finish(self):
         """
         Returns the collected stack and output as a pair (the new type of
-        instruction introduced in this file.
+        instruction introduced in this file.  If any symbols were involved,
+        we return a Folded operation instead -- see repiet.util.
         """
-        return tuple(self.stack), ''.join(self.outputs)
+        if self.depth or self.reads:
+            return _Folded(self.depth, tuple(self.effects), tuple(self.stack), tuple(self.ops))
+        return tuple(self.stack), ''.join(str(a) if op == 'DUT' else chr(a&255) for op, a in self.effects)
+
+    def _take(self, n):
+        """
+        Makes sure that there are n values on the stack -- in underflow mode
+        by pulling symbols up from beneath it.  Returns False if we can't.
+        """
+        stack = self.stack
+        if len(stack) >= n:
+            return True
+        if not self.underflow:
+            self.short = True
+            return False
+        k = n - len(stack)
+        if self.depth + k > _EXPRESSION_SIZE:
+            #a roll can reach arbitrarily deep -- past this, we'd rather
+            #leave it to runtime than name every value on the way down
+            return False
+        stack[:0] = [('s', self.depth + j) for j in range(k, 0, -1)]
+        self.depth += k
+        return True
 
     def RLL(self):
         #this is the most complicated part... if a roll goes below the depth
@@ -255,8 +386,17 @@ class _PPVM(object):
         #this isn't worth folding into the _check decorator because it's
         #already ugly-general
         stack = self.stack
+        if not self._take(2):
+            return False
+        if not (isinstance(stack[-1], int) and isinstance(stack[-2], int)):
+            return False
         #don't forget to discount the arguments we popped...
-        if len(stack) < 2 or len(stack)-2 < stack[-2]:
+        if self.bottom and len(stack) - 2 < stack[-2]:
+            #there's nothing beneath our stack, so this is just a pop (just
+            #as in the backends)
+            del stack[-2:]
+            return True
+        if not self._take(stack[-2] + 2):
             return False
         a = stack.pop() #was stack[-1]
         b = stack.pop() #was stack[-2]
@@ -272,34 +412,43 @@ class _PPVM(object):
         return True
 
     #DIN and CIN take user inputs; which we obviously don't know at
-    #compile time.
-    def DIN(self): return False
-    def CIN(self): return False
+    #compile time -- unless we're making symbols of them
+    def DIN(self): return self._read('DIN')
+    def CIN(self): return self._read('CIN')
+
+    def _read(self, op):
+        if not self.inputs:
+            return False
+        self.effects.append((op, self.reads))
+        self.stack.append(('i', self.reads))
+        self.reads += 1
+        return True
 
     #No ops, no problems
     def NOP(self): return True
 
     #for the next several operations, we return a value onto the stack
-    @_check(2)
+    @_check(2, True)
     def ADD(self, a, b): return b + a
 
-    @_check(2)
+    @_check(2, True)
     def SBT(self, a, b): return b - a
 
-    @_check(2)
+    @_check(2, True)
     def MLT(self, a, b): return b * a
 
-    @_check(2)
-    def DVD(self, a, b): return b // a
+    #like the backends, we pop the args of a division by zero and push nothing
+    @_check(2, True)
+    def DVD(self, a, b): return b // a if a else None
 
-    @_check(2)
-    def MOD(self, a, b): return b % a
+    @_check(2, True)
+    def MOD(self, a, b): return b % a if a else None
 
-    @_check(1)
+    @_check(1, True)
     def NOT(self, a): return int(not a)
 
-    @_check(2)
-    def GRT(self, a, b): return b > a
+    @_check(2, True)
+    def GRT(self, a, b): return int(b > a)
 
     @_check(1)
     def DPL(self, a): self.stack.append(a); return a
@@ -310,9 +459,9 @@ class _PPVM(object):
 
     #these two record the value into the list of outputs
     @_check(1)
-    def DUT(self, a): self.outputs.append(str(a))
+    def DUT(self, a): self.effects.append(('DUT', a))
 
     @_check(1)
-    def CUT(self, a): self.outputs.append(chr(a&255))
+    def CUT(self, a): self.effects.append(('CUT', a))
 
 
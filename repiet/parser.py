@@ -1,4 +1,4 @@
-from repiet.util import SLIDE as _SLIDE, HL as _HL, Node as _Node, OP as _OP, default_opinions as _default_opinions
+from repiet.util import SLIDE as _SLIDE, HL as _HL, Node as _Node, OP as _OP, Delta as _Delta, default_opinions as _default_opinions
 from repiet.lexer import Lexer as _Lexer
 
 __all__ = ["Parser"]
@@ -23,32 +23,46 @@ class Parser:
     destinations.  An instruction is either a 3-character opcode or an int
     representing a push.
 
+    Nodes are named by dense integer ids, in the order they were discovered.
     To get the name of the root, call P.root(), and Nodes themselves can be
-    retrieved by P[name].
+    retrieved by P[name].  A human-readable name (such as "x12Y40", naming
+    the entry pixel, direction pointer and codel chooser of the state) is
+    only built on request, by P.name(name).
 
     Construction of a parser takes linear time in the size of the lexer
     output, which is linear in the total image size.  The algorithm is a
     depth-first search beginning at the root, processing nodes found by the
-    lexer.  Discards the Lexer after initialization, to minimize memory use.
+    lexer.
+
+    The source is either an image filename or a Lexer, which may be shared
+    between Parsers with different opinions (the opinions of the Lexer take
+    precedence over codel_size and noncoding).  The Lexer is kept, so that
+    the program can be updated after an edit to its image (see P.update) --
+    which updates the Lexer as well, so it should not be shared in that case.
     """
-    def __init__(self, filename, **opinions):
+    #the optimization stage of the graph (see repiet.ir)
+    stage = 0
+
+    def __init__(self, source, **opinions):
         self._opinions = _default_opinions(**opinions)
+        lexer = source if isinstance(source, _Lexer) else _Lexer(source, **opinions)
+        #the lexer infers codel_size='auto' from the image
+        self._opinions['codel_size'] = lexer.codel_size
         self._process_opinions()
 
-        lexer = _Lexer(filename, **opinions)
-        p0 = 0, 0
-        d = c = 0
-        root = lexer.at(p0)
-        if root == _SLIDE:
-            p0, d, c = self._slide(lexer, p0, d, c)[0]
-            root = lexer.at(p0)
-
-        self._graph = {}
-        if root is None:
+        self._lexer = lexer
+        self._slides = {}
+        self._exits = {}
+        self._graph = []
+        self._states = []
+        self._boxes = []
+        state, self._rootbox = self._start(lexer)
+        if state is None:
             self._root = None
         else:
-            self._root = _name((p0, d, c))
-            self._parse(lexer, (p0, d, c))
+            self._root = 0
+            self._parse(lexer, state)
+        del self._exits, self._slides
 
 
     def root(self):
@@ -64,7 +78,7 @@ class Parser:
         None
 
         A Node is a namedtuple consisting of:
-            * a unique name
+            * a unique name (an int)
             * a 3-character opcode, an integer n denoting PSH(n) or None
             * a tuple of destination names
 
@@ -78,79 +92,212 @@ class Parser:
         """
         Returns all node objects as a list
         """
-        return list(self._graph.values())
+        return [node for node in self._graph if node is not None]
+
+    def name(self, name):
+        """
+        Returns a human-readable string naming the Node `name`
+        """
+        return _name(self._states[name])
+
+    def update(self, source, box=None):
+        """
+        Updates the parse graph after an edit to the image.  The source and
+        box are passed along to Lexer.update (so the source must be an image
+        filename, lexed by the 'python' or 'numpy' engine).  Only the states
+        whose transitions looked at the changed part of the image are parsed
+        again, along with any new states that they reach; states which are no
+        longer reachable are dropped.
+
+        Names are stable: a state keeps its name across updates, and new
+        states get new names.  Returns a Delta of the names of the Nodes
+        which have changed, been added and been removed.
+        """
+        lexer = self._lexer
+        dirty = lexer.update(source, box)
+        if dirty is None:
+            return _Delta((), (), ())
+        x0, y0, x1, y1 = dirty
+        def touched(b):
+            #state boxes are inclusive, the dirty box is half-open
+            return b[0] < x1 and b[2] >= x0 and b[1] < y1 and b[3] >= y0
+
+        graph = self._graph
+        boxes = self._boxes
+        old = list(graph)
+        ids = {state: name for name, state in enumerate(self._states)}
+        for name, node in enumerate(graph):
+            if node is not None and touched(boxes[name]):
+                graph[name] = None
+        self._slides = {}
+        self._exits = {}
+        if touched(self._rootbox):
+            state, self._rootbox = self._start(lexer)
+            self._root = None if state is None else (
+                         ids[state] if state in ids else self._number(ids, state))
+
+        #walk the graph from the root, parsing the states which have changed
+        #(or are new); those we don't reach are dropped
+        seen = set()
+        stack = [] if self._root is None else [self._root]
+        while stack:
+            name = stack.pop()
+            if name not in seen:
+                seen.add(name)
+                if graph[name] is None:
+                    self._visit(lexer, name, ids)
+                stack.extend(graph[name].dests)
+        del self._exits, self._slides
+        for name in range(len(graph)):
+            if name not in seen:
+                graph[name] = boxes[name] = None
+
+        old.extend([None]*(len(graph) - len(old)))
+        return _Delta(
+            tuple(n for n, (a, b) in enumerate(zip(old, graph)) if a is not None and b is not None and a != b),
+            tuple(n for n, (a, b) in enumerate(zip(old, graph)) if a is None and b is not None),
+            tuple(n for n, (a, b) in enumerate(zip(old, graph)) if a is not None and b is None),
+        )
+
+    def _start(self, lexer):
+        """
+        Finds the initial state of the interpreter, sliding out of the corner
+        if need be.  Returns the state (or None, if the program is trivial)
+        and the box of pixels examined to find it.
+        """
+        p0 = 0, 0
+        d = c = 0
+        box = 0, 0, 0, 0
+        root = lexer.at(p0)
+        if root == _SLIDE:
+            slid, box = self._slide(lexer, p0, d, c)
+            if not slid:
+                return None, box
+            p0, d, c = slid[0]
+            root = lexer.at(p0)
+        return (None if root is None else (p0, d, c)), box
 
     def _parse(self, lexer, state):
         """
-        Parses the lexed program with a quick graph traversal algorithm
+        Parses the lexed program with a quick graph traversal algorithm.
+        States are numbered as they're discovered, and the ids dictionary
+        is discarded once the graph is complete.
         """
+        ids = {}
         #another obnoxious performance hack -- stacks as recursive 2-ples
-        front = state, () #                              this is a stack
+        front = self._number(ids, state), () #           this is a stack
         while front:
-            state, front = front #                       this is a pop
-            op, dests = self._knock(lexer, *state)
-            name = _name(state)
-            dnames = tuple(_name(dest) for dest in dests)
-            ops = () if op == "NOP" else (op,)
-            self._graph[name] = _Node(name, ops, dnames)
-            for dest, dname in zip(dests, dnames):
-                if dname not in self._graph:
-                    #sentinel value to moderate stack size
-                    self._graph[dname] = None
-                    front = dest, front #                this is a push
-
-    def _knock(self, lexer, p, d, c, patience=8):
+            name, front = front #                        this is a pop
+            for dname in self._visit(lexer, name, ids):
+                front = dname, front #                   this is a push
+
+    def _visit(self, lexer, name, ids):
+        """
+        Parses the state `name` into a Node, and records the (inclusive) box
+        of pixels examined to compute it.  Returns the names of destinations
+        which were seen for the first time.
+        """
+        op, dests, self._boxes[name] = self._knock(lexer, *self._states[name])
+        dnames = []
+        new = []
+        for dest in dests:
+            dname = ids.get(dest)
+            if dname is None:
+                dname = self._number(ids, dest)
+                new.append(dname)
+            dnames.append(dname)
+        ops = () if op == "NOP" else (op,)
+        self._graph[name] = _Node(name, ops, tuple(dnames))
+        return new
+
+    def _number(self, ids, state):
+        """Names a new state with the next id, with a sentinel Node"""
+        name = ids[state] = len(self._states)
+        self._states.append(state)
+        self._graph.append(None)
+        self._boxes.append(None)
+        return name
+
+
+    def _knock(self, lexer, p, d, c):
         """
         Simulates a Piet interpreter at block p with DP=d and CC=c.
 
         Returns an instruction, the size of the current block (to be pushed,
-        maybe) and a list of destinations.
+        maybe), a list of destinations and the box of pixels examined.
 
         Called "knock" because we pick a corner, peek at the next pixel over
         neighbor in search of digrams.  If we find slidespace, we slide into
         it; if we're blocked, we alternately picking the other corner and
         turning clockwise.  Digrams emit instructions, sliding merely jumps.
+        The peeks themselves are looked up in the exit table of the block
+        (see _exit).
         """
         #retrieve the block at p
         b0 = lexer.at(p)
+        box = [p[0], p[1], p[0], p[1]]
         if b0 == _SLIDE:
             #this occurs for the "nonhalting" sliding opinion
-            return "NOP", (p, d, c)
+            return "NOP", (p, d, c), tuple(box)
+
+        exits = self._exits.get(b0.name)
+        if exits is None:
+            exits = self._exits[b0.name] = [None]*8
+
+        #we have the patience to try every corner of every side, and the
+        #first corner again -- advancing CC and DP alternately
+        for patience in range(8, -1, -1):
+            exit = exits[2*d + c]
+            if exit is None:
+                exit = exits[2*d + c] = self._exit(lexer, b0, d, c)
+            q, op = exit
+            _grow(box, q)
+            if op == _SLIDE:
+                #q is in a sliding region -- slide on through, and either NOP
+                #over to the next block or quit
+                slid, seen = self._slide(lexer, q, d, c)
+                _grow(box, seen[:2])
+                _grow(box, seen[2:])
+                if slid != 'timid':
+                    if slid == 'hang':
+                        slid = (p, d, c),
+                    return "NOP", slid, tuple(box)
+            elif op is not None:
+                #q has a different programming color.  An interpreter would
+                #emit an instruction and slide into b1.  We enumerate the
+                #destination states, to be consumed by a compiler.
+                return op, ((q, d, c), (q, d, c^1)) if op == 'SWT' else (
+                            tuple((q,(d+i)%4,c) for i in (0,1,2,3)) if op == 'PTR' else
+                            ((q, d, c),)), tuple(box)
+            #either q was out of bounds, or there's a blocking pixel at q.
+            #advance either DP or CC
+            if patience % 2:
+                d = (d+1)%4
+            else:
+                c ^= 1
+        return 'NOP', (), tuple(box)
 
+    def _exit(self, lexer, b0, d, c):
+        """
+        Computes an entry of the exit table of the block b0: a pair (q, op),
+        where q is the pixel just past the (d, c)-most corner of b0 and op is
+            * the instruction of the digram from b0 to the block at q
+            * SLIDE if q is in a sliding region
+            * None if q is out of bounds or blocking
+        Exit tables are lists of these pairs indexed by 2*DP + CC, which are
+        filled in as the entries are needed.
+        """
         #identify the (d,p)-most corner of b0, and step one pixel d-ward
         q = self._next(b0.corners[d, c], d)
         #examine the image contents at q
         b1 = lexer.at(q)
-
-        if b1 == _SLIDE:
-            #q is in a sliding region -- slide on through, and either NOP
-            #over to the next block or quit
-            slid = self._slide(lexer, q, d, c)
-            if slid == 'timid':
-                b1 = None
-            else:
-                if slid == 'hang':
-                    slid = (p, d, c),
-                return "NOP", slid
-
-        if b1 is None:
-            #either q was out of bounds, or there's a blocking pixel at q.
-            #advance either DP or CC, and recurse with 1 unit less patience
-            return self._knock(lexer, p, (d+1)%4, c, patience-1) if patience % 2 else (
-                   self._knock(lexer, p, d, c^1, patience-1) if patience > 0 else ('NOP', ()))
-        else:
-            #q has a different programming color.  An interpreter would emit
-            #an instruction and slide into b1.  We enumerate the destination
-            #states, to be consumed by a compiler.
-            h0,l0 = _HL[b0.color]
-            h1,l1 = _HL[b1.color]
-            #DMM's instructions are based in hue and darkness... awkward
-            op = self._OP[(h1-h0)%6][(l0-l1)%3]
-            if op == "PSH":
-                op = b0.size
-            return op, ((q, d, c), (q, d, c^1)) if op == 'SWT' else (
-                        tuple((q,(d+i)%4,c) for i in (0,1,2,3)) if op == 'PTR' else
-                        ((q, d, c),))
+        if b1 is None or b1 == _SLIDE:
+            return q, b1
+        h0,l0 = _HL[b0.color]
+        h1,l1 = _HL[b1.color]
+        #DMM's instructions are based in hue and darkness... awkward
+        op = self._OP[(h1-h0)%6][(l0-l1)%3]
+        return q, b0.size if op == "PSH" else op
 
     def _slide(self, lexer, p, d, c):
         """
@@ -158,34 +305,56 @@ class Parser:
         is encountered, it is returned in a singleton tuple.  Otherwise, the
         interpreter gets trapped in the sliding region and terminates -- we
         return an empty tuple.
+
+        Sliding states form a functional graph, so every state on the trail
+        shares the outcome of the slide -- we record it for each of them, and
+        stop early on reaching a state whose outcome is already known.  The
+        outcome is returned with the box of pixels examined along the way.
         """
+        slides = self._slides
         trail = set()
         stopslide = self._stopslide
+        state = p, d, c
+        box = [p[0], p[1], p[0], p[1]]
         while 1:
-            t = stopslide((p, d, c), trail)
+            t = stopslide(state, trail)
             if t is not None:
-                return t
+                break
+            t = slides.get(state)
+            if t is not None:
+                t, seen = t
+                _grow(box, seen[:2])
+                _grow(box, seen[2:])
+                break
 
             #Slides d-ward from the pixel at p.
             q = lexer.slide(p, d)
             #Go one step d-ward from q
             r = self._next(q, d)
-            #examine the image contents at r
+            #examine the image contents at r -- the run from p to r is in line
             b = lexer.at(r)
+            _grow(box, r)
 
             if b is None:
                 #either r was out of bounds, or there's a blocking pixel at r
-                #advance DP and CC, and recurse with updated trail.
+                #advance DP and CC, and continue with updated trail.
                 d = (d+1)%4
                 c^= 1
                 p = q
+                state = p, d, c
             elif b == _SLIDE:
                 #this shouldn't happen
                 raise RuntimeError(("Bug in Lexer -- {} and {} are adjacent pixels"
                                     "in different sliding regions").format(q, r))
             else:
                 #we found a block!
-                return (r, d, c),
+                t = (r, d, c),
+                break
+
+        box = tuple(box)
+        for state in trail:
+            slides[state] = t, box
+        return t, box
 
     def _process_opinions(self):
         """Process the opinions dictionary to ensure that the behavior of
@@ -232,6 +401,14 @@ class Parser:
         self._stopslide = stopslide.__get__(self, self.__class__)
 
 
+def _grow(box, p):
+    """Grows the box [x0, y0, x1, y1] to contain the point p=(x, y)"""
+    x, y = p
+    if x < box[0]: box[0] = x
+    elif x > box[2]: box[2] = x
+    if y < box[1]: box[1] = y
+    elif y > box[3]: box[3] = y
+
 def _name(state):
     """Makes a unique string for a given state"""
     (x, y), d, c = state
@@ -0,0 +1,192 @@
+from repiet.parser import Parser as _Parser
+from repiet.tracer import Tracer as _Tracer
+from repiet.optimizer import StaticEvaluator as _StaticEvaluator
+from repiet.minimizer import Minimizer as _Minimizer
+from repiet.analyzer import DepthAnalyzer as _DepthAnalyzer
+from repiet.ir import IR as _IR
+from repiet.util import Node as _Node, Folded as _Folded, Unchecked as _Unchecked, default_opinions as _default_opinions
+
+#the patterns of the Peephole optimizer, which are selected by name with the
+#'peephole' opinion
+patterns = 'fold', 'pop', 'not', 'roll', 'run'
+
+class Peephole:
+    """
+    A peephole optimizer for parse graphs.  We take the Nodes output by any
+    of the other stages, and rewrite short sequences of operations that the
+    StaticEvaluator left behind -- where it gave up, or wasn't run:
+
+        * 'fold' -- PSH n PSH m ADD becomes PSH n+m (likewise for the other
+          arithmetic operations, and PSH n NOT)
+        * 'pop' -- PSH n POP and DPL POP are removed
+        * 'not' -- NOT NOT NOT becomes NOT, and NOT NOT after a GRT which is
+          known to find enough values is removed (NOT NOT alone is not a
+          no-op -- it turns a value into 0 or 1)
+        * 'roll' -- PSH n PSH m RLL is removed when the roll does nothing,
+          and PSH 0 RLL becomes POP when the RLL is known to find its depth
+        * 'run' -- adjacent (stack, output) operations are merged, along
+          with the pushes just before them
+
+    Each rewrite leaves the stack and output exactly as they were, whether or
+    not the operations would find enough values on the stack, so the depth
+    annotations of a DepthAnalyzer still hold.  The 'peephole' opinion names
+    the patterns to apply, joined by '+' -- or 'all', or 'none'.
+
+    Peepholes have a similar interface to Parsers -- the name of the root is
+    P.root(), Node objects are fetched with P[name], and P.name(name) makes a
+    human-readable name.  Nodes have the names (integer ids) and
+    destinations of the source -- so like those of an updated Parser, the
+    names may have holes.  P.removed() reports the number of operations
+    removed by each pattern.
+
+    The source is a Parser, Tracer, StaticEvaluator, Minimizer, DepthAnalyzer
+    or IR, or anything a DepthAnalyzer can be built from -- an image filename
+    or a Lexer.
+    """
+    #the optimization stage of the graph (see repiet.ir)
+    stage = 5
+
+    def __init__(self, source, **opinions):
+        prog = source if isinstance(source, (_Parser, _Tracer, _StaticEvaluator, _Minimizer, _DepthAnalyzer, _IR)) else _DepthAnalyzer(source, **opinions)
+        self._prog = prog
+        self._patterns = _patterns(_default_opinions(**opinions)['peephole'])
+        self._removed = dict.fromkeys(self._patterns, 0)
+        self._root = prog.root()
+        nodes = prog.flatten() if self._root is not None else []
+        self._graph = graph = [None]*(max(node.name for node in nodes) + 1 if nodes else 0)
+        for node in nodes:
+            graph[node.name] = _Node(node.name, tuple(self._rewrite(node.ops)), node.dests)
+
+    def root(self):
+        """
+        Returns the root of the program.  If the program is trivial (that is,
+        returns immediately with no input or output), we return None
+        """
+        return self._root
+
+    def __getitem__(self, name):
+        """
+        Returns the Node associated with the input `name`, which must not be
+        None -- Nodes are of the same form as those of the source
+        """
+        return self._graph[name]
+
+    def flatten(self):
+        """
+        Returns all Node objects as a list
+        """
+        return [node for node in self._graph if node is not None]
+
+    def name(self, name):
+        """
+        Returns a human-readable string naming the Node `name`
+        """
+        return self._prog.name(name)
+
+    def removed(self):
+        """
+        Returns a dictionary mapping the name of each pattern applied to the
+        number of operations it removed
+        """
+        return dict(self._removed)
+
+    def _rewrite(self, ops):
+        """
+        Rewrites a list of operations in a single pass -- each operation is
+        matched against the end of the output, and a rewritten operation is
+        matched again in turn, so rewrites cascade.
+        """
+        out = []
+        on = self._patterns
+        removed = self._removed
+
+        def emit(op):
+            i = _op(op)
+            last = out[-1] if out else None
+            if 'fold' in on and len(out) > 1 and isinstance(last, int) and isinstance(out[-2], int) and isinstance(i, str) and i in _ARITHMETIC:
+                n, m = out[-2], last
+                x = _ARITHMETIC[i](n, m)
+                if x is not None:
+                    del out[-2:]
+                    removed['fold'] += 2
+                    return emit(x)
+            if 'fold' in on and i == 'NOT' and isinstance(last, int):
+                out.pop()
+                removed['fold'] += 1
+                return emit(int(not last))
+            if 'pop' in on and i == 'POP' and (isinstance(last, int) or _op(last) == 'DPL'):
+                out.pop()
+                removed['pop'] += 2
+                return
+            if 'not' in on and i == 'NOT' and _op(last) == 'NOT' and len(out) > 1:
+                #a NOT is known to push 0 or 1 if it finds a value, and an
+                #Unchecked GRT is known to push one
+                before = out[-2]
+                if _op(before) == 'NOT' or before == _Unchecked('GRT'):
+                    out.pop()
+                    removed['not'] += 2
+                    return
+            if 'roll' in on and i == 'RLL' and isinstance(last, int):
+                if len(out) > 1 and isinstance(out[-2], int):
+                    d, r = out[-2], last
+                    #the roll is skipped unless 0 < d <= the depth of the
+                    #stack, and does nothing when r%d == 0
+                    if d <= 0 or r % d == 0:
+                        del out[-2:]
+                        removed['roll'] += 3
+                        return
+                elif last == 0 and op is not i:
+                    out.pop()
+                    removed['roll'] += 1
+                    return emit(_Unchecked('POP'))
+            if 'run' in on and _isrun(op):
+                if _isrun(last):
+                    stk, outs = out.pop()
+                    removed['run'] += 1
+                    return emit((stk + op[0], outs + op[1]))
+                elif isinstance(last, int):
+                    out.pop()
+                    removed['run'] += 1
+                    return emit(((last,) + op[0], op[1]))
+            out.append(op)
+
+        for op in ops:
+            emit(op)
+        return out
+
+def _patterns(peephole):
+    """Parses the 'peephole' opinion into a tuple of pattern names"""
+    if peephole == 'all':
+        return patterns
+    elif peephole == 'none':
+        return ()
+    names = tuple(peephole.split('+'))
+    for name in names:
+        if name not in patterns:
+            raise ValueError("unknown peephole pattern {!r} (choose from {})".format(name, ', '.join(patterns)))
+    return names
+
+def _op(op):
+    """The opcode of an operation, whether or not it's Unchecked"""
+    return op.op if isinstance(op, _Unchecked) else op
+
+def _isrun(op):
+    """Whether op is a (stack, output) operation"""
+    return isinstance(op, tuple) and not isinstance(op, (_Folded, _Unchecked))
+
+def _div(n, m):
+    #the backends disagree on how to round a negative quotient, so we only
+    #fold the quotients they agree on
+    if m and (n % m == 0 or (n >= 0) == (m > 0)):
+        return n // m
+
+#the values computed by the arithmetic operations from the pushes n then m,
+#or None where the operation pushes nothing (or we'd rather not say)
+_ARITHMETIC = {
+    'ADD': lambda n, m: n + m,
+    'SBT': lambda n, m: n - m,
+    'MLT': lambda n, m: n * m,
+    'DVD': _div,
+    'MOD': lambda n, m: n % m if m else None,
+    'GRT': lambda n, m: int(n > m),
+}
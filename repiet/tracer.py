@@ -1,4 +1,5 @@
 from repiet.parser import Parser as _Parser
+from repiet.ir import IR as _IR
 from repiet.util import Node as _Node
 
 class Tracer:
@@ -16,21 +17,41 @@ class Tracer:
     contain that Node's name.  The Tracer stops on branching operations -- a
     SWT (or PTR) will have 2 (or 4) different destinations, to be chosen by 
     examining the top of the stack.  Additionally, an empty tuple of
-    destinations halts the program.
+    destinations halts the program.  Traces also stop where the program
+    merges -- at a parsed Node with more than one way in, which heads a trace
+    of its own -- so that no operation is copied into more than one trace.
 
     Tracers have a similar interface to Parsers -- the name of the root is
-    T.root(), and Node objects are fetched with T[name]
+    T.root(), Node objects are fetched with T[name], and T.name(name) makes
+    a human-readable name.  Nodes are named by dense integer ids, which are
+    distinct from the ids of the Parser.  T.absorbed(name) is the number of
+    parsed Nodes in a trace.
 
     Tracing a parsed program takes linear time in the number of parsed Nodes,
-    which is ultimately linear in the number of pixels in the image.
+    which is ultimately linear in the number of pixels in the image -- each
+    parsed Node is visited once to find the heads of traces, and once more
+    to be absorbed into its trace.
+
+    The source is a Parser (or an IR of one), or anything a Parser can be
+    built from -- an image filename or a Lexer.
     """
-    def __init__(self, filename, **opinions):
-        self._traces = {}
+    #the optimization stage of the graph (see repiet.ir)
+    stage = 1
+
+    def __init__(self, source, **opinions):
+        self._traces = []
+        self._heads = []
+        self._absorbed = []
+        self._ids = {}
 
-        parser = _Parser(filename, **opinions)
-        self._root = parser.root()
-        if self._root is not None:
+        parser = source if isinstance(source, (_Parser, _IR)) else _Parser(source, **opinions)
+        self._parser = parser
+        if parser.root() is None:
+            self._root = None
+        else:
+            self._root = self._id(parser.root())
             self._trace(parser)
+        del self._ids
 
     def root(self):
         """
@@ -61,71 +82,85 @@ class Tracer:
         """
         Returns all Node objects as a list
         """
-        return list(self._traces.values())
-    
+        return list(self._traces)
+
+    def name(self, name):
+        """
+        Returns a human-readable string naming the Node `name` -- which is
+        the name of the parsed Node heading the trace
+        """
+        return self._parser.name(self._heads[name])
+
+    def absorbed(self, name):
+        """
+        Returns the number of parsed Nodes which were compressed into the
+        trace `name`
+        """
+        return self._absorbed[name]
+
+    def _id(self, head):
+        """
+        Returns the id of the trace headed by the parsed Node `head`,
+        numbering it if it's new
+        """
+        name = self._ids.get(head)
+        if name is None:
+            name = self._ids[head] = len(self._heads)
+            self._heads.append(head)
+            self._traces.append(None)
+            self._absorbed.append(0)
+        return name
+
     def _trace(self, parser):
         """
-        Traces the parsed program with a quick graph traversal algorithm
+        Traces the parsed program with a quick graph traversal algorithm.
+        Every parsed Node belongs to exactly one trace: a trace follows the
+        single destinations from its head until it reaches a branch, a halt
+        or the head of another trace.
         """
         traces = self._traces
+        absorbed = self._absorbed
+        heads = self._find_heads(parser)
         #still using this obnoxiously idiomatic stack construction.  think
         #of the tuple (a,b) as a linked-list datastructure, where a is data
         #and b is essentially "next" (but actually it's the rest of the stack
         to_process = self._root, ()
         while to_process:
             name, to_process = to_process
-            node = parser[name]
-            ops, dests = self._trace_node(parser, node)
+            node = parser[self._heads[name]]
+            ops = list(node.ops)
+            count = 1
+            while len(node.dests) == 1 and node.dests[0] not in heads:
+                node = parser[node.dests[0]]
+                ops.extend(node.ops)
+                count += 1
+            dests = tuple(map(self._id, node.dests))
             traces[name] = _Node(name, tuple(ops), dests)
+            absorbed[name] = count
             for dest in dests:
-                if dest not in traces:
+                if traces[dest] is None:
                     to_process = dest, to_process
 
-    def _trace_node(self, parser, node):
-        """
-        Simulates a Piet interpreter, accumulating operations until a branch
-        or loop is discovered.  In the case of a loop, we split the trace into
-        two pieces -- the "intro" portion and "loop" portion.  This is done to
-        reduce code duplication -- the alternative would be to record the
-        intro and loop as a single trace, and then produce the loop as another
-        trace.  As a side-effect, we save a tiny amount of runtime.
-        """
-        #list of operations encountered during this trace
-        ops = []
-
-        #a mapping from the names of nodes we've encountered in this trace, to
-        #the length of ops when we first encountered it (to facilitate
-        #efficient loop construction)
-        hits = {}
-
-        while True:
-            if len(node.dests) == 0:
-                return ops, ()
-            if node.name in hits:
-                #oops, we've discovered a loop.
-                #all cases wind up going the same place
-                dests = node.name,
-                steps = hits[node.name]
-                if steps:
-                    #nontrivial intro, let's chop the trace in two
-                    intro = ops[:steps]
-                    loop = tuple(ops[steps:])
-                    #the intro is nontrivial, so we stash the looping portion
-                    self._traces[node.name] = _Node(node.name, loop, dests)
-                    #then, we return the intro segment
-                    return intro, dests
+    def _find_heads(self, parser):
+        """
+        Finds the parsed Nodes which head traces: the root, the destinations
+        of branches, and the Nodes with more than one way in.  Every cycle
+        passes through one of these, so the chains between them are simple
+        paths -- each is compressed into a trace once, by _trace.
+        """
+        root = parser.root()
+        heads = {root}
+        seen = {root}
+        stack = [root]
+        while stack:
+            dests = parser[stack.pop()].dests
+            if len(dests) > 1:
+                heads.update(dests)
+            for dest in dests:
+                if dest in seen:
+                    #we've found a second way in
+                    heads.add(dest)
                 else:
-                    #the intro is trivial, this is just a clean loop
-                    return ops, dests
-            elif len(node.dests) > 1:
-                #oops, we hit a branch.  record the operation and bail
-                ops.extend(node.ops)
-                return ops, node.dests
-            hits[node.name] = len(ops)
-                #no point in keeping silly NOPs around in our ops...
-            ops.extend(node.ops)
-            #there's a single destination, so let's step into it
-            node = parser[node.dests[0]]
-        
-
-
+                    seen.add(dest)
+                    stack.append(dest)
+        return heads
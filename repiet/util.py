@@ -20,15 +20,36 @@ CODING = {SLIDE, BLOCK}.intersection(HL)
 
 Node = _namedtuple('node', ['name', 'ops', 'dests'])
 Lexeme = _namedtuple('lexeme', ['name', 'corners', 'size', 'color'])
+Delta = _namedtuple('delta', ['changed', 'added', 'removed'])
 
-def default_opinions(codel_size=1, noncoding='block', sliding='halting', color_dir_h='-', color_dir_l='-'):
+#a run of operations folded by symbolic static evaluation: if the stack
+#holds at least depth values, pop them as the symbols ('s', 1) (the top)
+#through ('s', depth), perform the effects in order -- ('DIN', n) or
+#('CIN', n) reads the symbol ('i', n), and ('DUT', x) or ('CUT', x) prints
+#x -- and push the values of stack.  Values are ints, symbols or expressions
+#(opcode, x, y) / ('NOT', x), with x deeper in the stack than y.  Otherwise,
+#the original operations ops are performed instead -- as they are by
+#backends which can't write out symbols.
+Folded = _namedtuple('folded', ['depth', 'effects', 'stack', 'ops'])
+
+#an operation which is known to find enough values on the stack, so that
+#the backends needn't check (see repiet.analyzer)
+Unchecked = _namedtuple('unchecked', ['op'])
+
+def default_opinions(codel_size=1, noncoding='block', sliding='halting', color_dir_h='-', color_dir_l='-', lexer='python', strip=256, workers=1, budget=10000, evaluation='concrete', peephole='all'):
     """Constructs an opinions dictionary for a repiet compiler pass
     (implicity filling in defaults)"""
     return dict(codel_size=codel_size,
                 noncoding=noncoding,
                 sliding=sliding,
                 color_dir_h=color_dir_h,
-                color_dir_l=color_dir_l)
+                color_dir_l=color_dir_l,
+                lexer=lexer,
+                strip=strip,
+                workers=workers,
+                budget=budget,
+                evaluation=evaluation,
+                peephole=peephole)
 
 #below is stuff used in bin/repiet for argparse -- but it's convenient to
 #collect it here instead.
@@ -39,8 +60,19 @@ def _positive(arg):
     except: pass
     raise _argparse.ArgumentTypeError("%r is not a positive integer" % arg)
 
+def _codel_size(arg):
+    return arg if arg == 'auto' else _positive(arg)
+
+def _peephole(arg):
+    from repiet.peephole import _patterns
+    try:
+        _patterns(arg)
+    except ValueError as e:
+        raise _argparse.ArgumentTypeError(str(e))
+    return arg
+
 opinion_options = {
-    'codel_size': {'type':_positive, 'help':'Codel size'},
+    'codel_size': {'type':_codel_size, 'help':"Codel size, or 'auto' to infer it from the image"},
     'noncoding': {'type':str, 'choices':('block', 'slide', 'round'),
         'help':"Behavior for nonstandard pixel values.  'round' selects the nearest standard value"},
     'sliding': {'type':str, 'choices':('halting', 'nonhalting', 'timid'), 
@@ -50,4 +82,17 @@ opinion_options = {
                'help':"Determines how hue-change produces instructions (use + to emulate buggy interpreters)"},
     'color_dir_l': {'type':str, 'choices':('-', '+'), 
                'help':"Determines how lightness-change produces instructions (use + to emulate buggy interpreters)"},
+    'lexer': {'type':str, 'choices':('python', 'numpy', 'stream', 'lazy'),
+        'help':("Lexing engine -- 'numpy' labels blocks with array operations, which is much faster on large images; "
+                "'stream' does the same a strip at a time, for images too large to hold in memory; "
+                "'lazy' only lexes the blocks which the parser reaches")},
+    'strip': {'type':_positive, 'help':"Number of codel rows per strip, for the 'stream' lexer"},
+    'workers': {'type':_positive, 'help':"Number of processes lexing bands of the image, for the 'numpy' lexer"},
+    'budget': {'type':_positive, 'help':"Number of operations the static evaluator may simulate from each entry point"},
+    'evaluation': {'type':str, 'choices':('concrete', 'symbolic'),
+        'help':("Static evaluation -- 'symbolic' carries on past inputs and pops from beneath the known stack, "
+                "naming the values it can't know, to fold larger regions of the program")},
+    'peephole': {'type':_peephole,
+        'help':("Patterns of the peephole optimizer, joined by '+' -- any of fold, pop, not, roll and run, "
+                "or 'all' or 'none'")},
 }
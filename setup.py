@@ -18,5 +18,5 @@ setup(
     url=repiet.__url__,
     packages=['repiet', 'repiet._backends'],
     entry_points={"console_scripts": ["repiet=repiet.__main__:main"]},
-    install_requires=['Pillow'],
+    install_requires=['Pillow', 'numpy'],
 )
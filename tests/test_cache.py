@@ -0,0 +1,86 @@
+"""Checks that the compile cache returns what compiling from scratch does,
+reuses the stages it holds, and evicts the least recently used entries.  Run
+with pytest, from the root of the repo."""
+import os
+import shutil
+import pytest
+import repiet
+import repiet.cache
+from repiet.cache import Cache
+from repiet.compiler import Compile, Stage
+from repiet.ir import IR
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+@pytest.fixture
+def image(tmp_path):
+    filename = str(tmp_path / 'roll.png')
+    shutil.copy(os.path.join(HERE, 'roll.png'), filename)
+    return filename
+
+@pytest.fixture
+def built(monkeypatch):
+    """Records the source of each stage built by the cache"""
+    sources = []
+    stages = repiet.cache._stages
+    def recording(source, levels, opinions):
+        sources.append(source)
+        return stages(source, levels, opinions)
+    monkeypatch.setattr(repiet.cache, '_stages', recording)
+    return sources
+
+def test_hits_and_misses(tmp_path, image, built):
+    cache = Cache(str(tmp_path / 'cache'))
+    for backend in ('py', 'c', 'piet'):
+        code = cache.compile(image, backend, 2)
+        assert code == Compile(image, backend, 2)
+        assert cache.compile(image, backend, 2) == code
+    #the first compile builds the stages, the rest only render them again
+    assert built[0] == image
+    assert all(isinstance(source, IR) for source in built[1:])
+    del built[:]
+
+    #the lexing engine doesn't change the key, the other opinions do
+    cache.compile(image, 'py', 2, lexer='numpy')
+    assert built == []
+    cache.compile(image, 'py', 2, sliding='timid')
+    assert built == [image]
+
+def test_stage_reuse(tmp_path, image, built):
+    cache = Cache(str(tmp_path / 'cache'))
+    cache.compile(image, 'py', 2)
+    del built[:]
+    #a higher level starts from the highest stage held
+    assert cache.compile(image, 'c', 4) == Compile(image, 'c', 4)
+    assert [source.stage for source in built] == [2]
+    prog = cache.stage(image, 3)
+    assert isinstance(prog, IR) and prog.stage == 3
+    assert [n.ops for n in prog.flatten()] == [n.ops for n in Stage(image, 3).flatten()]
+
+def test_edits_and_versions_miss(tmp_path, image, built, monkeypatch):
+    cache = Cache(str(tmp_path / 'cache'))
+    cache.compile(image, 'py', 1)
+    shutil.copy(os.path.join(HERE, 'tieP.png'), image)
+    assert cache.compile(image, 'py', 1) == Compile(image, 'py', 1)
+    monkeypatch.setattr(repiet, '__version__', repiet.__version__ + '.dev')
+    cache.compile(image, 'py', 1)
+    assert built == [image]*3
+
+def test_lru_eviction(tmp_path, image):
+    directory = str(tmp_path / 'cache')
+    Cache(directory).compile(image, 'py', 0)
+    Cache(directory).compile(image, 'c', 0)
+    entries = {e.split('.', 1)[1]: os.path.join(directory, e) for e in os.listdir(directory)}
+    assert sorted(entries) == ['O0.rpb', 'c-O0.txt', 'py-O0.txt']
+    size = {k: os.path.getsize(path) for k, path in entries.items()}
+
+    #the py output is the oldest, until it's used again
+    for age, k in enumerate(('py-O0.txt', 'O0.rpb', 'c-O0.txt')):
+        os.utime(entries[k], (1000 + age, 1000 + age))
+    cache = Cache(directory, size['py-O0.txt'] + size['c-O0.txt'])
+    assert cache.compile(image, 'py', 0) == Compile(image, 'py', 0)
+    cache._evict()
+    assert sorted(e.split('.', 1)[1] for e in os.listdir(directory)) == ['c-O0.txt', 'py-O0.txt']
+    cache = Cache(directory, 1)
+    cache._evict()
+    assert os.listdir(directory) == []
@@ -0,0 +1,58 @@
+"""Checks that compiling under a sweep of opinions matches compiling under
+each combination in turn, for the Sweep function and the command line.  Run
+with pytest, from the root of the repo."""
+import os
+import pytest
+import repiet.compiler
+from repiet.__main__ import main
+from repiet.compiler import Compile, Sweep
+from repiet.lexer import Lexer
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+IMAGES = 'roll.png', 'tieP.png', 'pointer5.png', 'slide2.png'
+
+@pytest.mark.parametrize('image', IMAGES)
+def test_sweep_matches_compile(monkeypatch, image):
+    lexed = []
+    class Counting(Lexer):
+        def __init__(self, *args, **opinions):
+            lexed.append(opinions['noncoding'])
+            super().__init__(*args, **opinions)
+    monkeypatch.setattr(repiet.compiler, '_Lexer', Counting)
+
+    filename = os.path.join(HERE, image)
+    opinions = dict(noncoding=('block', 'round'), sliding=['halting', 'nonhalting', 'timid'],
+                    evaluation=('concrete', 'symbolic'), codel_size=1)
+    out = Sweep(filename, ('py', 'c'), (0, 4), **opinions)
+    #the image is lexed once for each value of the one lexing opinion swept
+    assert sorted(lexed) == ['block', 'round']
+    monkeypatch.undo()
+    assert len(out) == 12
+    for combo, codes in out.items():
+        assert [k for k, v in combo] == sorted(opinions)
+        assert codes == Compile(filename, ('py', 'c'), (0, 4), **dict(combo))
+
+def test_sweep_over_a_lexer():
+    lexer = Lexer(os.path.join(HERE, 'roll.png'))
+    out = Sweep(lexer, 'py', 2, sliding=('halting', 'timid'), noncoding='block')
+    for combo, code in out.items():
+        assert code == Compile(lexer, 'py', 2, **dict(combo))
+    with pytest.raises(ValueError):
+        Sweep(lexer, 'py', 2, noncoding=('block', 'slide'))
+
+def test_command_line_sweep(tmp_path):
+    filename = os.path.join(HERE, 'pointer5.png')
+    out = str(tmp_path / 'prog.py')
+    main([filename, '-o', out, '-O', '3', '--sliding', 'halting,timid', '--codel_size', '1'])
+    for sliding in ('halting', 'timid'):
+        with open(str(tmp_path / ('prog.sliding-%s.py' % sliding))) as f:
+            assert f.read() == Compile(filename, 'py', 3, sliding=sliding)
+
+    #options which a sweep would ignore are refused
+    for extra in (['--dump', str(tmp_path / 'prog.rpb')], ['--cache-dir', str(tmp_path / 'cache')]):
+        with pytest.raises(SystemExit):
+            main([filename, '-o', out, '--sliding', 'halting,timid'] + extra)
+    ir = str(tmp_path / 'prog.rpb')
+    main([filename, '-o', out, '--dump', ir])
+    with pytest.raises(SystemExit):
+        main([ir, '-o', out, '--sliding', 'halting,timid'])
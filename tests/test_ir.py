@@ -0,0 +1,36 @@
+"""Checks that graphs of every stage survive a round trip through the binary
+IR format.  Run with pytest, from the root of the repo."""
+import os
+import pytest
+from repiet.compiler import Stage
+from repiet.ir import IR, dump
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+#images and their codel sizes -- wc.png has Folded and Unchecked operations
+IMAGES = (('roll.png', 1), ('tieP.png', 1), ('pointer3.png', 1), ('slide2.png', 1),
+          (os.path.join('..', 'assets', 'wc.png'), 10))
+
+@pytest.mark.parametrize('image, codel_size', IMAGES)
+@pytest.mark.parametrize('level', range(6))
+@pytest.mark.parametrize('evaluation', ('concrete', 'symbolic'))
+def test_round_trip(tmp_path, image, codel_size, level, evaluation):
+    prog = Stage(os.path.join(HERE, image), level, codel_size=codel_size, evaluation=evaluation)
+    filename = str(tmp_path / 'prog.rpb')
+    dump(prog, filename)
+    ir = IR(filename)
+    assert ir.stage == prog.stage
+    nodes = prog.flatten()
+    index = {node.name: i for i, node in enumerate(nodes)}
+    assert ir.root() == index.get(prog.root())
+    assert len(ir.flatten()) == len(nodes)
+    for i, node in enumerate(nodes):
+        assert ir[i].ops == node.ops
+        assert ir[i].dests == tuple(index[d] for d in node.dests)
+        assert ir.name(i) == prog.name(node.name)
+
+def test_next_stage_from_ir(tmp_path):
+    filename = str(tmp_path / 'prog.rpb')
+    image = os.path.join(HERE, 'roll.png')
+    dump(Stage(image, 2), filename)
+    a, b = Stage(IR(filename), 5), Stage(image, 5)
+    assert [n.ops for n in a.flatten()] == [n.ops for n in b.flatten()]
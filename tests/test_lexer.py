@@ -0,0 +1,188 @@
+"""Checks that the lexing engines agree with each other, and that incremental
+updates agree with lexing and parsing from scratch.  Run with pytest, from
+the root of the repo."""
+import os
+import shutil
+import numpy as np
+import pytest
+from PIL import Image
+from repiet.compiler import Compile
+from repiet.lexer import Lexer, _SLIDING, _mapped
+from repiet.parser import Parser
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+IMAGES = sorted(f for f in os.listdir(HERE) if f.endswith('.png'))
+ENGINES = 'python', 'numpy', 'stream', 'lazy'
+
+def canonical(prog):
+    """The graph of prog, with Nodes renumbered in the order they're reached
+    from the root -- equal for graphs which are equal up to naming"""
+    root = prog.root()
+    if root is None:
+        return None
+    ids = {root: 0}
+    order = [root]
+    for name in order:
+        for d in prog[name].dests:
+            if d not in ids:
+                ids[d] = len(order)
+                order.append(d)
+    return tuple((prog[n].ops, tuple(ids[d] for d in prog[n].dests)) for n in order)
+
+@pytest.mark.parametrize('image', IMAGES)
+@pytest.mark.parametrize('sliding', ('halting', 'nonhalting', 'timid'))
+def test_engines_agree(image, sliding):
+    filename = os.path.join(HERE, image)
+    graphs = [canonical(Parser(Lexer(filename, lexer=e), sliding=sliding)) for e in ENGINES]
+    assert all(g == graphs[0] for g in graphs[1:])
+
+@pytest.mark.parametrize('engine', ('python', 'numpy'))
+@pytest.mark.parametrize('image', ('roll.png', 'tieP.png', 'pointer5.png'))
+def test_update_matches_fresh_parse(tmp_path, engine, image):
+    filename = str(tmp_path / image)
+    shutil.copy(os.path.join(HERE, image), filename)
+    parser = Parser(Lexer(filename, lexer=engine))
+
+    #paint over a corner of the image, then put it back
+    im = Image.open(filename).convert('RGB')
+    original = im.copy()
+    w, h = im.size
+    box = (0, 0, max(1, w//3), max(1, h//3))
+    im.paste((255, 0, 0), box)
+    for edited, box in ((im, box), (original, box)):
+        edited.save(filename)
+        parser.update(filename, box)
+        assert canonical(parser) == canonical(Parser(Lexer(filename, lexer=engine)))
+
+def test_update_needs_a_grid():
+    filename = os.path.join(HERE, 'roll.png')
+    with pytest.raises(ValueError):
+        Lexer(filename, lexer='lazy').update(filename)
+
+def tables(lexer):
+    """The tables of a lexer with a label grid, leaving out the sliding
+    extents of nonwhite codels, which are garbage"""
+    white = lexer._label == _SLIDING
+    return [lexer._label, lexer._corners, lexer._size, lexer._color] + [run[white] for run in lexer._run]
+
+@pytest.mark.parametrize('workers', (2, 3, 7))
+def test_workers_agree(tmp_path, workers):
+    #blocks and white runs which cross the seams between the bands
+    rng = np.random.default_rng(workers)
+    colors = np.array([(255, 255, 255), (0, 0, 0), (255, 0, 0), (0, 0, 192), (192, 255, 192)], np.uint8)
+    pixels = colors[rng.choice(len(colors), (8, 10), p=(.5, .1, .2, .1, .1))]
+    filename = str(tmp_path / 'bands.png')
+    Image.fromarray(pixels.repeat(5, axis=0).repeat(3, axis=1)).save(filename)
+    for image in [filename] + [os.path.join(HERE, f) for f in IMAGES]:
+        expected = tables(Lexer(image, lexer='numpy'))
+        for a, b in zip(tables(Lexer(image, lexer='numpy', workers=workers)), expected):
+            assert np.array_equal(a, b), image
+
+def paletted(filename, out):
+    """Saves the image filename as a palette image out, with exactly its
+    colors"""
+    pixels = np.asarray(Image.open(filename).convert('RGB'))
+    colors, index = np.unique(pixels.reshape(-1, 3), axis=0, return_inverse=True)
+    im = Image.fromarray(index.reshape(pixels.shape[:2]).astype(np.uint8), 'P')
+    im.putpalette(colors.ravel().tolist())
+    im.save(out)
+    assert Image.open(out).mode == 'P'
+
+@pytest.mark.parametrize('engine', ENGINES)
+@pytest.mark.parametrize('noncoding', ('block', 'slide', 'round'))
+def test_palette_images(tmp_path, engine, noncoding):
+    #nonstandard colors, which are classified by the noncoding opinion
+    rng = np.random.default_rng(0)
+    colors = np.array([(255, 255, 255), (250, 5, 5), (128, 128, 128), (0, 0, 192), (200, 255, 190)], np.uint8)
+    noise = str(tmp_path / 'noise.png')
+    Image.fromarray(colors[rng.choice(len(colors), (12, 12))]).save(noise)
+    images = [(os.path.join(HERE, f), 1) for f in IMAGES]
+    images += [(noise, 1), (os.path.join(HERE, '..', 'assets', 'wc.png'), 10)]
+    out = str(tmp_path / 'paletted.png')
+    for filename, codel_size in images:
+        paletted(filename, out)
+        lex = dict(lexer=engine, noncoding=noncoding, codel_size=codel_size)
+        assert canonical(Parser(Lexer(out, **lex))) == canonical(Parser(Lexer(filename, **lex))), filename
+
+@pytest.mark.parametrize('scale', (3, 13))
+def test_auto_codel_size(tmp_path, scale):
+    out = str(tmp_path / 'scaled.png')
+    for image in IMAGES:
+        im = Image.open(os.path.join(HERE, image)).convert('RGB')
+        im = im.resize((im.width*scale, im.height*scale), Image.NEAREST)
+        im.save(out)
+        lexer = Lexer(out, codel_size='auto')
+        assert lexer.codel_size == scale, image
+        expected = canonical(Parser(Lexer(os.path.join(HERE, image))))
+        assert canonical(Parser(lexer)) == expected, image
+        assert canonical(Parser(out, codel_size='auto')) == expected, image
+
+        #a pixel out of place in the last row -- past the first strip of 256
+        #rows, for the larger images -- spoils the grid
+        x, y = im.width - 1, im.height - 1
+        im.putpixel((x, y), tuple(255 - c for c in im.getpixel((x, y))))
+        im.save(out)
+        assert Lexer(out, codel_size='auto').codel_size == 1, image
+
+def test_auto_codel_size_wc():
+    assert Lexer(os.path.join(HERE, '..', 'assets', 'wc.png'), codel_size='auto').codel_size == 10
+
+def netpbm(filename, out, magic):
+    """Writes the pixels of the image filename to out, as a binary PPM (with
+    a comment in its header) or as an RGB or RGB_ALPHA PAM"""
+    pixels = np.asarray(Image.open(filename).convert('RGBA' if magic == 'RGB_ALPHA' else 'RGB'))
+    Y, X, depth = pixels.shape
+    if magic == 'P6':
+        header = 'P6\n# made by repiet\n%d %d\n255\n' % (X, Y)
+    else:
+        header = 'P7\nWIDTH %d\nHEIGHT %d\nDEPTH %d\nMAXVAL 255\nTUPLTYPE %s\nENDHDR\n' % (X, Y, depth, magic)
+    with open(out, 'wb') as f:
+        f.write(header.encode() + pixels.tobytes())
+
+@pytest.mark.parametrize('engine', ENGINES)
+@pytest.mark.parametrize('magic', ('P6', 'RGB', 'RGB_ALPHA'))
+def test_netpbm_images(tmp_path, engine, magic):
+    out = str(tmp_path / 'image.pnm')
+    for image in IMAGES:
+        filename = os.path.join(HERE, image)
+        netpbm(filename, out, magic)
+        assert _mapped(out) is not None
+        expected = canonical(Parser(Lexer(filename, lexer=engine)))
+        assert canonical(Parser(Lexer(out, lexer=engine))) == expected, image
+    #PNGs, and PPMs with 16-bit channels, are decoded by PIL instead
+    assert _mapped(filename) is None
+    with open(out, 'wb') as f:
+        f.write(b'P6\n1 1\n65535\n' + bytes(6))
+    assert _mapped(out) is None
+
+def test_piet_round_trip(tmp_path):
+    #the piet backend writes a binary PPM, which is mapped straight back in
+    out = str(tmp_path / 'roll.ppm')
+    with open(out, 'wb') as f:
+        f.write(Compile(os.path.join(HERE, 'roll.png'), 'piet', optimization_level=0))
+    assert _mapped(out) is not None
+    graphs = [canonical(Parser(Lexer(out, lexer=e))) for e in ENGINES]
+    assert graphs[0] is not None and all(g == graphs[0] for g in graphs[1:])
+
+@pytest.mark.parametrize('engine', ('python', 'numpy'))
+@pytest.mark.parametrize('canvas', ((255, 255, 255), (0, 0, 0)))
+def test_update_blank_canvas(tmp_path, engine, canvas):
+    #paint blocks one at a time onto a canvas with no blocks at all, then
+    #paint over them again, so that most rows of the tables are orphaned
+    filename = str(tmp_path / 'canvas.png')
+    im = Image.new('RGB', (24, 16), canvas)
+    im.save(filename)
+    lexer = Lexer(filename, lexer=engine)
+    parser = Parser(lexer)
+    assert len(lexer._size) == 0
+    colors = (255, 0, 0), (255, 255, 0), (0, 255, 0), (0, 0, 255), (255, 192, 192), (192, 0, 0)
+    for k in range(24):
+        x, y = 5*k % 22, 3*k % 14
+        box = (x, y, x + 2 + k % 3, y + 2)
+        im.paste(colors[k % len(colors)], box)
+        im.save(filename)
+        parser.update(filename, box)
+        fresh = Lexer(filename, lexer=engine)
+        assert canonical(parser) == canonical(Parser(fresh))
+        assert np.array_equal(lexer._codes(lexer._label), fresh._codes(fresh._label))
+        assert len(lexer._size) <= 2*len(np.unique(lexer._label[lexer._label >= 0])) + 1
@@ -0,0 +1,66 @@
+"""Checks the Minimizer against a plain Moore partition refinement.  Run with
+pytest, from the root of the repo."""
+import os
+import pytest
+from repiet.compiler import Stage
+from repiet.minimizer import Minimizer
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+IMAGES = sorted(f for f in os.listdir(HERE) if f.endswith('.png'))
+
+def moore(prog):
+    """Returns the block of each Node of prog, refining the partition by
+    operations until the destinations of a block agree -- in quadratic
+    time, but obviously"""
+    nodes = prog.flatten()
+    index = {node.name: i for i, node in enumerate(nodes)}
+    block = [(node.ops, len(node.dests)) for node in nodes]
+    while True:
+        keys = [(block[i], tuple(block[index[d]] for d in node.dests)) for i, node in enumerate(nodes)]
+        ids = {}
+        new = [ids.setdefault(k, len(ids)) for k in keys]
+        if len(ids) == len(set(block)):
+            return index, new
+        block = new
+
+@pytest.mark.parametrize('image', IMAGES)
+@pytest.mark.parametrize('level', (0, 1, 2))
+def test_matches_moore(image, level):
+    prog = Stage(os.path.join(HERE, image), level)
+    m = Minimizer(prog)
+    if prog.root() is None:
+        assert m.root() is None
+        return
+    index, block = moore(prog)
+    nodes = prog.flatten()
+
+    #the blocks reachable from the root
+    root = block[index[prog.root()]]
+    reached = {root}
+    todo = [root]
+    rep = {}
+    for i, b in enumerate(block):
+        rep.setdefault(b, i)
+    while todo:
+        b = todo.pop()
+        for d in nodes[rep[b]].dests:
+            d = block[index[d]]
+            if d not in reached:
+                reached.add(d)
+                todo.append(d)
+    assert len(m.flatten()) == len(reached)
+
+    #and the quotient behaves like the original, Node for Node
+    ids = {m.root(): root}
+    todo = [m.root()]
+    while todo:
+        name = todo.pop()
+        node = nodes[rep[ids[name]]]
+        assert m[name].ops == node.ops
+        for d, e in zip(m[name].dests, node.dests):
+            e = block[index[e]]
+            if d not in ids:
+                ids[d] = e
+                todo.append(d)
+            assert ids[d] == e
+    assert len(set(ids.values())) == len(ids)
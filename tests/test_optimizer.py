@@ -0,0 +1,113 @@
+"""Checks that every optimization level, under concrete and symbolic
+evaluation, compiles programs which behave just like the parse graph does.
+Run with pytest, from the root of the repo."""
+import os
+import shutil
+import subprocess
+import sys
+import time
+import pytest
+from repiet.compiler import Compile
+from repiet.ir import IR, dump
+from repiet.optimizer import StaticEvaluator
+from repiet.util import Node
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+#images which halt, and their codel sizes
+IMAGES = [('pointer%d.png' % k, 1) for k in range(1, 9)]
+IMAGES += [('roll.png', 1), ('tieP.png', 1), ('corner0.png', 1), ('slide2.png', 1),
+           (os.path.join('..', 'assets', 'wc.png'), 10)]
+INPUT = b'42 is\nthe answer\n'
+
+def run(tmp_path, code, ext, input=INPUT):
+    filename = str(tmp_path / ('prog' + ext))
+    with open(filename, 'w') as f:
+        f.write(code)
+    if ext == '.py':
+        cmd = [sys.executable, filename]
+    else:
+        subprocess.run(['gcc' if ext == '.c' else 'g++', '-w', '-o', filename + '.out', filename], check=True)
+        cmd = [filename + '.out']
+    prog = subprocess.run(cmd, input=input, capture_output=True, timeout=10)
+    #the Python backend ends with a traceback when input runs out -- only
+    #the output and exit status are compared
+    return prog.stdout, prog.returncode
+
+@pytest.mark.parametrize('image, codel_size', IMAGES)
+@pytest.mark.parametrize('evaluation', ('concrete', 'symbolic'))
+def test_python_levels_agree(tmp_path, image, codel_size, evaluation):
+    codes = Compile(os.path.join(HERE, image), 'py', range(6), codel_size=codel_size, evaluation=evaluation)
+    expected = run(tmp_path, codes['py', 0], '.py')
+    for level in range(1, 6):
+        assert run(tmp_path, codes['py', level], '.py') == expected, level
+
+@pytest.mark.skipif(shutil.which('gcc') is None, reason='needs gcc')
+@pytest.mark.parametrize('image, codel_size', IMAGES)
+def test_c_levels_agree(tmp_path, image, codel_size):
+    codes = Compile(os.path.join(HERE, image), 'c', (0, 4, 6), codel_size=codel_size, evaluation='symbolic')
+    expected = run(tmp_path, codes['c', 0], '.c')
+    for level in (4, 6):
+        assert run(tmp_path, codes['c', level], '.c') == expected, level
+
+@pytest.mark.skipif(shutil.which('g++') is None, reason='needs g++')
+@pytest.mark.parametrize('image, codel_size', IMAGES)
+def test_cpp_levels_agree(tmp_path, image, codel_size):
+    #symbolic evaluation leaves Folded operations at -O2, which are marked
+    #Unchecked (with other operations) at -O4
+    codes = Compile(os.path.join(HERE, image), 'cpp', (0, 2, 4), codel_size=codel_size, evaluation='symbolic')
+    expected = run(tmp_path, codes['cpp', 0], '.cpp')
+    for level in (2, 4):
+        assert run(tmp_path, codes['cpp', level], '.cpp') == expected, level
+
+class _Graph:
+    """A traced graph, built from a list of Nodes named by their index"""
+    stage = 1
+    def __init__(self, nodes):
+        self._nodes = nodes
+    def root(self):
+        return 0
+    def flatten(self):
+        return list(self._nodes)
+    def name(self, name):
+        return 'n%d' % name
+
+def test_deep_symbolic_roll(tmp_path):
+    #a roll 10**8 deep, beneath an unknown stack, is left to runtime
+    filename = str(tmp_path / 'roll.rpb')
+    dump(_Graph([Node(0, ('CIN', 'SWT'), (1, 1)),
+                 Node(1, (10, 'DPL', 'MLT', 'DPL', 'MLT', 'DPL', 'MLT', 1, 'RLL', 5, 'DUT'), ())]), filename)
+    start = time.time()
+    s = StaticEvaluator(IR(filename), evaluation='symbolic')
+    assert time.time() - start < 5
+    assert any('RLL' in node.ops for node in s.flatten())
+
+@pytest.mark.parametrize('budget', (1, 5, 20, 1000))
+def test_budget(tmp_path, budget):
+    #a chain of 40 traces, each printing a letter
+    filename = str(tmp_path / 'chain.rpb')
+    dump(_Graph([Node(i, (65 + i % 26, 'CUT'), (i+1,) if i < 39 else ()) for i in range(40)]), filename)
+    s = StaticEvaluator(IR(filename), budget=budget)
+    name, printed = s.root(), []
+    while name is not None:
+        node = s[name]
+        (stack, out), = node.ops
+        #the trace which goes past the budget is the last one folded
+        assert stack == () and 2*(len(out) - 1) <= budget
+        printed.append(out)
+        name = node.dests[0] if node.dests else None
+    assert ''.join(printed) == ''.join(chr(65 + i % 26) for i in range(40))
+    assert len(s.flatten()) == len(printed)
+    assert (len(printed) == 1) == (budget >= 78)
+
+@pytest.mark.parametrize('backend, ext, cc', (('c', '.c', 'gcc'), ('cpp', '.cpp', 'g++')))
+def test_folded_read(tmp_path, backend, ext, cc):
+    #the fold of DIN DPL 1 ADD is written out as the original ops, so a read
+    #which comes up empty pushes nothing, and the SWT and DUT are skipped
+    if shutil.which(cc) is None:
+        pytest.skip('needs ' + cc)
+    filename = str(tmp_path / 'read.rpb')
+    dump(_Graph([Node(0, ('DIN', 'DPL', 1, 'ADD', 'SWT'), (1, 1)), Node(1, ('DUT', 7, 'DUT'), ())]), filename)
+    codes = Compile(IR(filename), backend, (1, 4, 5, 6), evaluation='symbolic')
+    for input, expected in ((b'x\n', b'7'), (b'5\n', b'57')):
+        for level in (1, 4, 5, 6):
+            assert run(tmp_path, codes[backend, level], ext, input) == (expected, 0), (input, level)
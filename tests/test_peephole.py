@@ -0,0 +1,94 @@
+"""Checks the patterns of the Peephole optimizer on hand-made Nodes.  Run with
+pytest, from the root of the repo."""
+import os
+import shutil
+import pytest
+from PIL import Image
+from repiet.analyzer import DepthAnalyzer
+from repiet.compiler import Compile, Stage
+from repiet.ir import IR, dump
+from repiet.parser import Parser
+from repiet.peephole import Peephole
+from repiet.util import Node, Unchecked
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+class _Graph:
+    """A traced graph of a single Node"""
+    stage = 1
+    def __init__(self, ops):
+        self._node = Node(0, tuple(ops), ())
+    def root(self):
+        return 0
+    def flatten(self):
+        return [self._node]
+    def name(self, name):
+        return str(name)
+
+def peephole(tmp_path, ops, analyze=True, **opinions):
+    filename = str(tmp_path / 'prog.rpb')
+    dump(_Graph(ops), filename)
+    source = IR(filename)
+    p = Peephole(DepthAnalyzer(source) if analyze else source, **opinions)
+    return tuple(op.op if isinstance(op, Unchecked) else op for op in p[0].ops), p.removed()
+
+@pytest.mark.parametrize('ops, expected, pattern, removed', [
+    ((2, 3, 'ADD', 'DUT'), (5, 'DUT'), 'fold', 2),
+    ((7, -2, 'DVD', 'DUT'), (7, -2, 'DVD', 'DUT'), 'fold', 0),
+    ((0, 'NOT', 'DUT'), (1, 'DUT'), 'fold', 1),
+    ((7, 'DPL', 'POP', 1, 'POP', 'DUT'), (7, 'DUT'), 'pop', 4),
+    ((5, 'DPL', 'MLT', 'NOT', 'NOT', 'NOT', 'DUT'), (5, 'DPL', 'MLT', 'NOT', 'DUT'), 'not', 2),
+    ((5, 6, 'DPL', 'MLT', 'GRT', 'NOT', 'NOT', 'DUT'), (5, 6, 'DPL', 'MLT', 'GRT', 'DUT'), 'not', 2),
+    ((4, 5, 6, 3, 0, 'RLL', 'DUT'), (4, 5, 6, 'DUT'), 'roll', 3),
+    ((4, 5, 0, 'RLL', 'DUT'), (4, 'DUT'), 'roll', 3),
+])
+def test_patterns(tmp_path, ops, expected, pattern, removed):
+    out, counts = peephole(tmp_path, ops, peephole=pattern)
+    assert out == expected
+    assert counts == {pattern: removed}
+
+def test_underflow_is_kept(tmp_path):
+    #NOT NOT on a value of unknown depth makes it 0 or 1, and a GRT which
+    #may not find two values may leave it alone
+    ops = (7, 'CIN', 'GRT', 'NOT', 'NOT', 'DUT')
+    assert peephole(tmp_path, ops)[0] == ops
+    #PSH 0 RLL only pops when the RLL is known to find its depth
+    assert peephole(tmp_path, (0, 'RLL', 'DUT'), analyze=False)[0] == (0, 'RLL', 'DUT')
+
+def test_unknown_pattern(tmp_path):
+    with pytest.raises(ValueError):
+        peephole(tmp_path, (1,), peephole='fold+bogus')
+
+def test_updated_parser(tmp_path):
+    #an update leaves holes in the names of the Parser's Nodes
+    filename = str(tmp_path / 'roll.png')
+    shutil.copy(os.path.join(HERE, 'roll.png'), filename)
+    parser = Parser(filename)
+    im = Image.open(filename).convert('RGB')
+    box = (0, 0, 10, 10)
+    im.paste((255, 0, 0), box)
+    im.save(filename)
+    delta = parser.update(filename, box)
+    assert delta.removed
+    names = [node.name for node in parser.flatten()]
+    assert len(names) <= max(names)
+
+    p = Peephole(parser)
+    assert [node.name for node in p.flatten()] == names
+    assert all(p[n].dests == parser[n].dests for n in names)
+    #and the program is compiled just as from a fresh Parser
+    for level in (4, 5):
+        assert reached(Stage(parser, level)) == reached(Stage(Parser(filename), level))
+    assert Compile(parser, 'py', 5) == Compile(Stage(parser, 4), 'py', 5)
+
+def reached(prog):
+    """The operations and destinations of the Nodes of prog, renumbered in the
+    order they're reached from the root"""
+    ids = {prog.root(): 0}
+    order = [prog.root()]
+    for name in order:
+        for d in prog[name].dests:
+            if d not in ids:
+                ids[d] = len(order)
+                order.append(d)
+    return [(prog[n].ops, tuple(ids[d] for d in prog[n].dests)) for n in order]
@@ -0,0 +1,49 @@
+"""Checks that the Tracer absorbs every parsed Node into exactly one trace.
+Run with pytest, from the root of the repo."""
+import os
+import pytest
+from repiet.ir import IR, dump
+from repiet.parser import Parser
+from repiet.tracer import Tracer
+from repiet.util import Node
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+IMAGES = sorted(f for f in os.listdir(HERE) if f.endswith('.png'))
+
+@pytest.mark.parametrize('image', IMAGES)
+def test_every_node_absorbed_once(image):
+    parser = Parser(os.path.join(HERE, image))
+    tracer = Tracer(parser)
+    if parser.root() is None:
+        assert tracer.root() is None
+        return
+    nodes = parser.flatten()
+    traces = tracer.flatten()
+    assert all(tracer.absorbed(t.name) >= 1 for t in traces)
+    assert sum(tracer.absorbed(t.name) for t in traces) == len(nodes)
+    assert sum(len(t.ops) for t in traces) == sum(len(n.ops) for n in nodes)
+
+class _Graph:
+    """A parse graph, built from a list of Nodes named by their index"""
+    stage = 0
+    def __init__(self, nodes):
+        self._nodes = nodes
+    def root(self):
+        return 0
+    def flatten(self):
+        return list(self._nodes)
+    def name(self, name):
+        return str(name)
+
+def test_chains(tmp_path):
+    #0 -> 1 -> 2 branches to 3 -> 4 -> 2 and 5, which halts -- 2 has two ways
+    #in, and 3 and 5 follow a branch, so they head traces
+    filename = str(tmp_path / 'chains.rpb')
+    dump(_Graph([Node(0, (1,), (1,)), Node(1, ('DPL',), (2,)), Node(2, ('SWT',), (3, 5)),
+                 Node(3, (2,), (4,)), Node(4, ('ADD',), (2,)), Node(5, ('DUT',), ())]), filename)
+    tracer = Tracer(IR(filename))
+    traces = {tracer.name(t.name): t for t in tracer.flatten()}
+    assert {k: (t.ops, tracer.absorbed(t.name)) for k, t in traces.items()} == {
+        '0': ((1, 'DPL'), 2), '2': (('SWT',), 1), '3': ((2, 'ADD'), 2), '5': (('DUT',), 1)}
+    assert [tracer.name(d) for d in traces['2'].dests] == ['3', '5']
+    assert [tracer.name(d) for d in traces['3'].dests] == ['2']